@@ -4,12 +4,13 @@ from .download_gene_signatures import *
 from .get_gene_targets import get_gene_targets
 from .get_target_annotations import get_target_annotations, query_uniprot_mapping_api
 from .read_pset import pset_df_to_nested_dict, read_pset_file, read_pset
-from .build_all_pset_tables import build_all_pset_tables
+from .build_all_pset_tables import build_all_pset_tables, build_all_pset_tables_parallel
 from .get_chembl_targets import get_chembl_targets
 from .get_chembl_compound_targets import get_chembl_compound_target_mappings
 from .build_target_tables import build_target_tables
 from .combine_pset_tables import combine_all_pset_tables
-from .build_synonym_tables import build_cell_synonym_df, build_compound_synonym_df, build_tissue_synonym_df
+from .build_synonym_tables import build_cell_synonym_df, build_compound_synonym_df, build_tissue_synonym_df, \
+    build_all_synonym_dfs
 from .build_cellosaurus import build_cellosaurus_df
 from .build_clinical_trial_tables import build_clinical_trial_tables
 from .map_genes_to_genomic_coordinates import map_genes_to_genomic_coordinates
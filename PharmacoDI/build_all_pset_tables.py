@@ -4,10 +4,12 @@ import re
 import pandas as pd
 import numpy as np
 from datetime import date
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .read_pset import read_pset, pset_df_to_nested_dict
 from .build_primary_pset_tables import build_primary_pset_tables, build_cell_df, build_compound_df, build_tissue_df
 from .build_experiment_tables import build_experiment_tables, build_experiment_df
 from .build_gene_compound_tissue_dataset_tables import build_gene_compound_tissue_dataset_df
-from .write_pset_table import write_pset_table
+from .write_pset_table import write_pset_tables
 from .build_dataset_join_tables import build_dataset_join_dfs, build_dataset_cell_df
 
 # -- Enable logging
@@ -40,7 +42,8 @@ def build_all_pset_tables(
     @param pset_name: [`str`] The name of the PSet
     @param procdata_dir: [`str`] The file path to the directory containing processed data
     @param gene_sig_dir: [`str`] The file path to the directory containing gene_compounds data
-    @return: [`None`]
+    @return: [`bool`] True once all tables are written; None if building them
+        failed (the error is logged by `logger.catch`)
     """
     pset_dfs = {}
 
@@ -66,9 +69,9 @@ def build_all_pset_tables(
     pset_dfs['dataset_statistics'] = build_dataset_stats_df(
         pset_dict, pset_name, pset_dfs)
 
-    # Write all tables to CSV files
-    for df_name in pset_dfs.keys():
-        write_pset_table(pset_dfs[df_name], df_name, pset_name, procdata_dir)
+    # Write all tables to .jay files; a failed write raises here, so the log
+    #>below is only written once every table is on disk
+    write_pset_tables(pset_dfs, pset_name, procdata_dir)
 
     log_file = open(os.path.join(procdata_dir, pset_name, 
         f'{pset_name}_log.txt'), "w")
@@ -76,6 +79,61 @@ def build_all_pset_tables(
     log_file.writelines(f'{table}\n' for table in pset_dfs.keys())
     log_file.write(f'on {date.today()}')
     log_file.close()
+    return True
+
+
+@logger.catch
+def build_all_pset_tables_parallel(
+    pset_names: list,
+    rawdata_dir: str,
+    procdata_dir: str,
+    gene_sig_dir: str,
+    max_workers: int=None
+) -> None:
+    """
+    Build all tables for several datasets, one PSet per worker process.
+
+    Each worker reads its own PSet from `rawdata_dir`, so only the PSet name 
+    is sent to the worker instead of pickling the full nested dictionary.
+
+    @param pset_names: [`list`] The names of the PSets to build tables for
+    @param rawdata_dir: [`str`] The file path to the directory containing the 
+        exported PSet files (see `read_pset`)
+    @param procdata_dir: [`str`] The file path to the directory containing processed data
+    @param gene_sig_dir: [`str`] The file path to the directory containing gene_compounds data
+    @param max_workers: [`int`] The maximum number of worker processes. Defaults
+        to the number of CPUs.
+    @return: [`None`]
+    """
+    failed_psets = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_read_and_build_all_pset_tables, pset_name, 
+                rawdata_dir, procdata_dir, gene_sig_dir): pset_name 
+            for pset_name in pset_names}
+        for future in as_completed(futures):
+            pset_name = futures[future]
+            # A failed build is logged in its worker and returns None, while
+            #>errors reading the PSet are raised here
+            try:
+                built = future.result()
+            except Exception:
+                logger.exception(f'Failed to read the {pset_name} PSet')
+                built = False
+            if built:
+                logger.info(f'Finished building tables for {pset_name}')
+            else:
+                failed_psets.append(pset_name)
+    if len(failed_psets) > 0:
+        raise RuntimeError('Failed to build tables for the PSets: '
+            f'{", ".join(failed_psets)}')
+
+
+def _read_and_build_all_pset_tables(pset_name, rawdata_dir, procdata_dir, 
+        gene_sig_dir):
+    """Worker for build_all_pset_tables_parallel; returns whether the tables were built"""
+    pset_dict = pset_df_to_nested_dict(read_pset(pset_name, rawdata_dir))
+    return build_all_pset_tables(pset_dict, pset_name, procdata_dir, 
+        gene_sig_dir) is True
 
 
 @logger.catch
@@ -96,8 +154,11 @@ def build_mol_cell_df(
     @return: [`pd.DataFrame`] The table with the number of profiles for each cell line, 
         for each molecular data type
     """
-    mol_cell_df = pd.DataFrame(
-        columns=['cell_id', 'dataset_id', 'mDataType', 'num_prof'])
+    # Collect the table for each molecular type and concatenate them once;
+    #>appending in the loop copies every previous row on each iteration. The
+    #>empty frame first keeps the column order of the result
+    mol_cell_dfs = [pd.DataFrame(
+        columns=['cell_id', 'dataset_id', 'mDataType', 'num_prof'])]
     if 'molecularProfiles' in pset_dict:
         profiles_dict = pset_dict['molecularProfiles']
         molecularTypes = list(profiles_dict.keys())
@@ -124,8 +185,8 @@ def build_mol_cell_df(
             df = dataset_cell_df.copy()
             df['mDataType'] = mDataType
             df['num_prof'] = 0
-        # Append to mol_cell_df
-        mol_cell_df = mol_cell_df.append(df)
+        mol_cell_dfs.append(df)
+    mol_cell_df = pd.concat(mol_cell_dfs)
 
     # Replace any NaN in the num_profiles column with 0
     mask = mol_cell_df.query('num_prof.isna()').index
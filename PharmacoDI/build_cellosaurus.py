@@ -1,9 +1,9 @@
 import pandas as pd
-import os
 from multiprocessing import Pool, cpu_count
 from collections import defaultdict
 from datatable import dt, fread, f, g, join
-from PharmacoDI.combine_pset_tables import join_tables, write_table, rename_and_key
+import polars as pl
+from PharmacoDI.combine_pset_tables import write_table, read_table, rename_and_key
 
 # -- Enable logging
 from loguru import logger
@@ -39,7 +39,7 @@ def build_cellosaurus_df(cellosaurus_path, output_dir):
     @param output_dir: [`string`] The directory to write the cellosaurus table
     @param cell_df: [`datatable.Frame`] The cell table; should be renamed, keyed,
                                         and shouldn't have 'tissue_id' column
-    @return: [`datatable.Frame`] The cellosaurus table
+    @return: [`polars.DataFrame`] The cellosaurus table
     """
 
     with open(cellosaurus_path) as f:
@@ -77,16 +77,17 @@ def build_cellosaurus_df(cellosaurus_path, output_dir):
     cellosaurus_df['cell_id'] = cellosaurus_df['identifier']
 
     # Load cell_df
-    cell_path = os.path.join(output_dir, 'cell.jay')
-    cell_df = rename_and_key(dt.fread(cell_path), 'cell_id')
+    cell_df = rename_and_key(
+        read_table('cell', output_dir, columns=['id', 'name']), 'cell_id')
+    cell_df = dt.Frame(cell_df.to_arrow())
 
     # Convert to datatable and join with cell_df
     cellosaurus_df = dt.Frame(cellosaurus_df)
     cellosaurus_df.key = 'cell_id'
-    df = cell_df[:, :, join(dt.Frame(cellosaurus_df))]
+    df = cell_df[:, :, join(cellosaurus_df)]
     df = df[dt.f.id >= 1, :]
     df = df[:, ['cell_id', 'id', 'accession', 'as', 'sy',
                 'dr', 'rx', 'ww', 'cc', 'st', 'di', 'ox', 'hi', 'oi', 'sx', 'ca']]
     df.names = {'cell_id': 'identifier', 'id': 'cell_id'}
-    df = write_table(df, 'cellosaurus', output_dir)
+    df = write_table(pl.from_arrow(df.to_arrow()), 'cellosaurus', output_dir)
     return df
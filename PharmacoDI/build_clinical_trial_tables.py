@@ -1,10 +1,10 @@
-import os
 import requests
 import pandas as pd
-from datatable import dt, fread, f, g, join
+import polars as pl
 from urllib3.exceptions import HTTPError
 from .get_chembl_compound_targets import parallelize
-from .combine_pset_tables import write_table
+from .combine_pset_tables import write_table, read_table
+from .utilities import HTTP_SESSION
 
 # -- Enable logging
 from loguru import logger
@@ -33,8 +33,8 @@ def build_clinical_trial_tables(output_dir: str) -> pd.DataFrame:
     @return: None
     """
     # Load compound synonym table
-    compound_file = os.path.join(output_dir, 'compound_synonym.jay')
-    compound_df = fread(compound_file).to_pandas()[['compound_id', 'compound_name']]
+    compound_df = read_table('compound_synonym', output_dir,
+        columns=['compound_id', 'compound_name']).to_pandas()
 
     # Query clinicaltrials.gov API to get clinical trials by compound name
     logger.info('Getting clinical trials from clinicaltrials.gov...')
@@ -70,8 +70,8 @@ def build_clinical_trial_tables(output_dir: str) -> pd.DataFrame:
     compound_trial_df = pd.merge(compound_trial_df, compound_df, on='compound_name')
 
     # Write both tables
-    write_table(dt.Frame(clin_trial_df), 'clinical_trial', output_dir, add_index=False)
-    write_table(dt.Frame(compound_trial_df[['clinical_trial_id', 'compound_id']]), 'compound_trial', output_dir, add_index=False)
+    write_table(pl.from_pandas(clin_trial_df), 'clinical_trial', output_dir, add_index=False)
+    write_table(pl.from_pandas(compound_trial_df[['clinical_trial_id', 'compound_id']]), 'compound_trial', output_dir, add_index=False)
 
 
 @logger.catch
@@ -98,7 +98,9 @@ def get_clinical_trials_by_compound_names(compound_names):
         except:
             failed_compounds = [*failed_compounds, compound_name]
             next
-        # If not all studies were returned, make additional calls
+        # If not all studies were returned, make additional calls, keeping
+        #>each page to concatenate once at the end
+        study_pages = [studies]
         while num_studies_found > num_studies_returned:
             min_rank += 1000
             max_rank += 1000
@@ -108,8 +110,9 @@ def get_clinical_trials_by_compound_names(compound_names):
                 )
             except:
                 next
-            studies = pd.concat([studies, more_studies])
+            study_pages.append(more_studies)
             num_studies_returned += n_returned
+        studies = pd.concat(study_pages) if len(study_pages) > 1 else studies
         studies['compound_name'] = f"{compound_name}"
         all_studies.append(studies)
     if (len(failed_compounds) > 0):
@@ -145,7 +148,7 @@ def get_clinical_trials_for_compound(
         'max_rnk': max_rank,
         'fmt': 'json'
     }
-    r = requests.get(base_url, params=params)
+    r = HTTP_SESSION.get(base_url, params=params)
     studies = pd.DataFrame(columns=['Rank', 'NCTId', 'OverallStatus', 
         'SeeAlsoLinkURL'])
     # Check that request was successful
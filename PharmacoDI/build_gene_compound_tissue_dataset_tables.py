@@ -4,7 +4,6 @@ import pandas as pd
 import numpy as np
 import polars as pl
 from datatable import dt, fread, f, g, join, by, sort
-import re
 
 # -- Enable logging
 from loguru import logger
@@ -83,8 +82,9 @@ def build_gene_compound_tissue_dataset_df(
     # Rename foreign key columns
     gctd_df.rename(columns={'gene': 'gene_id', 'compound': 'compound_id',
         'tissue': 'tissue_id', 'dataset': 'dataset_id'}, inplace=True)
+    # Strip ENSEMBL versions with one vectorized regex over the column
     gctd_df['gene_id'] = gctd_df['gene_id'] \
-        .apply(lambda x: re.sub(r'\..*$', '', x))
+        .str.replace(r'\..*$', '', regex=True)
     # Reorder columns
     return gctd_df[['gene_id', 'compound_id', 'dataset_id', 'tissue_id',
         'estimate', 'lower_analytic', 'upper_analytic', 
@@ -3,6 +3,8 @@ import warnings
 import numpy as np
 import re
 from datatable import dt, f, g, join, sort, update, fread
+import polars as pl
+from PharmacoDI.combine_pset_tables import fread_table, write_table
 
 # -- Enable logging
 from loguru import logger
@@ -22,7 +24,7 @@ logger.configure(**logger_config)
 
 @logger.catch
 def build_gene_compound_tissue_df(gene_compound_tissue_file, gene_file, 
-    compound_file, tissue_file, output_dir):
+    compound_file, tissue_file, output_dir, write_jay=False):
     """
     Build gene_compound_tissue table (description?)
 
@@ -31,9 +33,11 @@ def build_gene_compound_tissue_df(gene_compound_tissue_file, gene_file,
     @param compound_file: [`str`] Path to the compound table .csv file.
     @param tissue_file: [`str`] Path to the tissue table .csv file.
     @param output_dir: [`str`] Path to write the output file to.
+    @param write_jay: [`bool`] Also write the legacy 'gene_compound_tissue.jay'
+        file for consumers which haven't moved to .parquet. Default is False.
 
-    @return [`datatable.Frame`] Writes the 'gene_compound_tissue.csv' file to 
-    output_dir then returns the table.
+    @return [`None`] Writes the 'gene_compound_tissue.parquet' file to 
+    output_dir.
     """
     # -- Check the input files exist
     for fl in [gene_compound_tissue_file, gene_file, compound_file, tissue_file]:
@@ -41,9 +45,9 @@ def build_gene_compound_tissue_df(gene_compound_tissue_file, gene_file,
             raise FileNotFoundError(f'Could not find the {fl}')
 
     # -- Read in mapping tables
-    gene_dt = fread(gene_file)
-    compound_dt = fread(compound_file)
-    tissue_dt = fread(tissue_file)
+    gene_dt = fread_table(gene_file)
+    compound_dt = fread_table(compound_file)
+    tissue_dt = fread_table(tissue_file)
 
     # -- Read in gene_compound_tissue table
     gct_dt = fread(gene_compound_tissue_file)
@@ -70,55 +74,67 @@ def build_gene_compound_tissue_df(gene_compound_tissue_file, gene_file,
             ' has missing columns!')
 
     # -- Map to existing FK ids
-    # gene id
-    gene_dt.names = {'id': 'gene_id', 'name': 'gene_name'}
-    gene_dt.key = 'gene_name'
-    # NOTE: the g object references the joined tables namespace
-    gct_dt1[:, update(gene_id=g.gene_id), join(gene_dt)]
+    # Dictionary encode the join keys under a shared string cache, so the
+    #>joins compare integer codes instead of hashing the name strings
+    with pl.StringCache():
+        gct_df = pl.from_arrow(gct_dt1.to_arrow()) \
+            .drop(['gene_id', 'compound_id', 'tissue_id']) \
+            .with_columns([pl.col(name).cast(pl.Utf8).cast(pl.Categorical)
+                for name in ('gene_name', 'compound_name', 'tissue_name')])
+        gct_df = gct_df \
+            .join(_to_join_df(gene_dt, 'gene'), on='gene_name', how='left') \
+            .join(_to_join_df(compound_dt, 'compound'), on='compound_name',
+                how='left') \
+            .join(_to_join_df(tissue_dt, 'tissue'), on='tissue_name',
+                how='left')
 
     # check for failed genes
-    failed_genes = gct_dt1[dt.isna(f.gene_id), 'gene_name'].to_numpy().flatten()
+    failed_genes = gct_df.filter(pl.col('gene_id').is_null()) \
+        .get_column('gene_name').cast(pl.Utf8).to_list()
     if len(failed_genes) > 0:
         raise ValueError(f'Genes {failed_genes} failed to map!')
 
-    if (np.any(gct_dt1[:, dt.isna(f.gene_id)].to_numpy())):
-        warnings.warn('Some gene_ids in gene_compound_tissue are still NA! Dropping'
-            'the missing rows...')
-        gct_dt1 = gct_dt1[~dt.isna(f.gene_id), :]
-    del gct_dt1[:, 'gene_name']
-
-    # compound id
-    compound_dt.names = {'id': 'compound_id', 'name': 'compound_name'}
-    del compound_dt[:, 'compound_uid']
-    compound_dt.key = 'compound_name'
-    gct_dt1[:, update(compound_id=g.compound_id), join(compound_dt)]
-
-    # tissue id
-    tissue_dt.names = {'id': 'tissue_id', 'name': 'tissue_name'}
-    tissue_dt.key = 'tissue_name'
-    gct_dt1[:, update(tissue_id=g.tissue_id), join(tissue_dt)]
-
     ## TODO: Handle failed tissue mappings?
 
     # -- Sort then assign the primary key column
-    ## TODO:: Is there a way to sort by reference?
-    gct_dt2 = gct_dt1[:, list(gct_table_columns), 
-        sort('gene_id', 'compound_id', 'tissue_id', 'mDataType')]
-    gct_dt2[:, update(id=range(1, gct_dt2.nrows + 1))]
+    gct_df = gct_df \
+        .select(list(gct_table_columns)) \
+        .sort(['gene_id', 'compound_id', 'tissue_id', 'mDataType'])
+    gct_df = gct_df.with_columns(
+        pl.Series('id', np.arange(1, gct_df.height + 1)))
 
     # Sanity check we didn't lose any rows
-    if not gct_dt.nrows == gct_dt2.nrows:
+    if not gct_dt.nrows == gct_df.height:
         warnings.warn('The compound_gene_tissue table has lost some rows!')
 
-    gct_dt2.to_jay(os.path.join(output_dir, 'gene_compound_tissue.jay'))
+    write_table(gct_df, 'gene_compound_tissue', output_dir, add_index=False)
+    if write_jay:
+        dt.Frame(gct_df.to_arrow()) \
+            .to_jay(os.path.join(output_dir, 'gene_compound_tissue.jay'))
+
+
+
+def _to_join_df(df, table):
+    """
+    Convert a primary table to a polars DataFrame mapping `{table}_name` to
+    `{table}_id`, with the name column dictionary encoded for joins.
+
+    @param df: [`datatable.Frame`] A primary table with 'id' and 'name' columns.
+    @param table: [`str`] The name of the table (ex. 'gene').
 
+    @return [`polars.DataFrame`] The two column join table. Must be called
+        inside the same `polars.StringCache` as the table it is joined to.
+    """
+    return pl.from_arrow(df[:, ['id', 'name']].to_arrow()) \
+        .rename({'id': f'{table}_id', 'name': f'{table}_name'}) \
+        .with_columns(pl.col(f'{table}_name').cast(pl.Categorical))
 
 
 ## FIXME:: This function is almost identical to the previous one, refactor
 ##>into a helper for gene_compound instead of copy pasting code
 @logger.catch
 def build_gene_compound_dataset_df(gene_compound_dataset_file, gene_file, 
-    compound_file, dataset_file, output_dir, compound_names):
+    compound_file, dataset_file, output_dir, compound_names, write_jay=False):
     """
     Build gene_compound_dataset table (description?)
 
@@ -131,9 +147,11 @@ def build_gene_compound_dataset_df(gene_compound_dataset_file, gene_file,
         updated compound names to the dataset. This is to ensure that corrected
         compound annotations still make it into the database without the need
         to rerun all the gene signatures
+    @param write_jay: [`bool`] Also write the legacy 'gene_compound_dataset.jay'
+        file for consumers which haven't moved to .parquet. Default is False.
 
-    @return [`datatable.Frame`] Writes the 'gene_compound_dataset.csv' file to 
-        output_dir the returns the table.
+    @return [`None`] Writes the 'gene_compound_dataset.parquet' file to 
+        output_dir.
     """
     # -- Check the input files exist
     for fl in [gene_compound_dataset_file, gene_file, compound_file, dataset_file]:
@@ -141,9 +159,9 @@ def build_gene_compound_dataset_df(gene_compound_dataset_file, gene_file,
             raise FileNotFoundError(f'Could not find the {fl}')
 
     # -- Read in mapping tables
-    gene_dt = fread(gene_file)
-    compound_dt = fread(compound_file)
-    dataset_dt = fread(dataset_file)
+    gene_dt = fread_table(gene_file)
+    compound_dt = fread_table(compound_file)
+    dataset_dt = fread_table(dataset_file)
 
     # -- Read in gene_compound_tissue table
     gcd_dt = fread(gene_compound_dataset_file)
@@ -182,13 +200,11 @@ def build_gene_compound_dataset_df(gene_compound_dataset_file, gene_file,
     # NOTE: the g object references the joined tables namespace
     gcd_dt1[:, update(gene_id=g.gene_id), join(gene_dt)]
 
-    # make sure all genes mapped
+    # make sure all genes mapped, only rescanning for NA rows if some didn't
     failed_genes = np.unique(gcd_dt1[dt.isna(f.gene_id), 'gene_name'] \
         .to_numpy().flatten())
     if len(failed_genes) > 0:
         warnings.warn(f'The genes: {failed_genes} did not map!')
-
-    if (np.any(gcd_dt1[:, dt.isna(f.gene_id)].to_numpy())):
         warnings.warn('Some gene_ids in gene_compound_dataset are still NA!'
             'Dropping the missing rows...')
         gcd_dt1 = gcd_dt1[~dt.isna(f.gene_id), :]
@@ -233,7 +249,10 @@ def build_gene_compound_dataset_df(gene_compound_dataset_file, gene_file,
     if not gcd_dt.nrows == gcd_dt2.nrows:
         warnings.warn('The gene_compound_dataset table has lost some rows!')
 
-    gcd_dt2.to_jay(os.path.join(output_dir, 'gene_compound_dataset.jay'))
+    write_table(pl.from_arrow(gcd_dt2.to_arrow()), 'gene_compound_dataset',
+        output_dir, add_index=False)
+    if write_jay:
+        gcd_dt2.to_jay(os.path.join(output_dir, 'gene_compound_dataset.jay'))
 
 @logger.catch
 def build_gene_compound_df(gene_compound_file, gene_file, compound_file, 
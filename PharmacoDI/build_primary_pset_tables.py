@@ -3,12 +3,11 @@ import glob
 import pandas as pd
 import numpy as np
 import polars as pl
-import re
 
 from polars import col
 from datatable import dt, fread, f, g, by, sort
 
-from .utilities import harmonize_df_columns
+from .utilities import harmonize_df_columns, ENS_VERSION_RE
 
 # -- Enable logging
 from loguru import logger
@@ -49,7 +48,6 @@ def build_primary_pset_tables(pset_dict, pset_name):
     return pset_dfs
 
 
-@logger.catch
 def build_gene_df(pset_dict):
     """
     Build a table containing all genes in a dataset.
@@ -57,17 +55,21 @@ def build_gene_df(pset_dict):
     @param pset_dict: [`dict`] A nested dictionary containing all tables in the PSet
     @return: [`DataFrame`] The gene table
     """
-    gene_df = pd.Series([], name='name', dtype='str')
-    for mDataType in pset_dict['molecularProfiles']:
-        gene_df = gene_df.append(pd.Series(pd.unique(
-            pset_dict['molecularProfiles'][mDataType]['rowData']['.features']),
-            name='name', dtype='str'))
-    gene_df.replace(r'\.[0-9]*$', '', regex=True, inplace=True)
-    gene_df.drop_duplicates(inplace=True)
-    return gene_df
+    features = [pl.Series('name', 
+            pset_dict['molecularProfiles'][mDataType]['rowData']['.features'],
+            dtype=pl.Utf8)
+        for mDataType in pset_dict['molecularProfiles']]
+    if len(features) == 0:
+        return pd.Series([], name='name', dtype='str')
+    # Strip the ENSEMBL versions and drop duplicates over all features at once
+    #>in polars, whose regex engine matches in linear time without the per 
+    #>string Python call of pandas' str.replace
+    gene_df = pl.concat(features) \
+        .str.replace(ENS_VERSION_RE.pattern, '') \
+        .unique(maintain_order=True)
+    return gene_df.to_pandas()
 
 
-@logger.catch
 def build_tissue_df(pset_dict):
     """
     Build a table containing all tissues in a dataset.
@@ -83,7 +85,6 @@ def build_tissue_df(pset_dict):
     return tissue_df
 
 
-@logger.catch
 def build_compound_df(pset_dict):
     """
     Build a table containing all compounds in a dataset.
@@ -95,7 +96,6 @@ def build_compound_df(pset_dict):
     return compound_df
 
 
-@logger.catch
 def build_gene_annotation_df(pset_dict):
     """
     Build a table mapping each gene in a dataset to its gene annotations.
@@ -118,15 +118,16 @@ def build_gene_annotation_df(pset_dict):
     gene_annotation_df = pl.concat(df_list) \
         .rename({'.features': 'gene_id'})
     # Remove Ensembl gene version
-    gene_annotation_df['gene_id'] = gene_annotation_df['gene_id'] \
-        .apply(lambda x: re.sub(r'\..*$', '', x))
+    gene_annotation_df = gene_annotation_df.with_columns(
+        pl.col('gene_id').str.replace(ENS_VERSION_RE.pattern, ''))
+    # Hash dedup over the rows; keep the first occurrence of each in order, so
+    #>the PSet table (and the ids assigned from it) is reproducible
     gene_annotation_df = gene_annotation_df \
-        .drop_duplicates() \
+        .unique(keep='first', maintain_order=True) \
         .to_pandas()
     return gene_annotation_df
 
 
-@logger.catch
 def build_compound_annotation_df(
     pset_dict: dict,
     column_dict: dict={'compound_id': str, 'smiles': str, 'inchikey': str, 
@@ -153,7 +154,6 @@ def build_compound_annotation_df(
 
 
 # TODO - confirm that you're using the correct cell id
-@logger.catch
 def build_cell_df(pset_dict):
     """
     Build a table containing all the cells in a dataset, mapped to their tissues.
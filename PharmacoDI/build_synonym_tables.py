@@ -1,17 +1,14 @@
-# old dependencies
-import glob
-import pandas as pd
-from PharmacoDI.combine_pset_tables import write_table
-
-# new dependenciess
 import os
-import warnings
-import numpy as np
 import re
-# NOTE: No melt/pivot for datatable yet? Using polars instead
-from datatable import dt, f, g, join, sort, update, fread
+import csv
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import polars as pl
 from polars import col
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+import pyarrow.parquet as pq
+from PharmacoDI.combine_pset_tables import read_table, write_table
 
 # -- Enable logging
 from loguru import logger
@@ -28,210 +25,297 @@ logger_config = {
 }
 logger.configure(**logger_config)
 
+# Leading token of a metadata column name (ex. 'GDSC1000' in 'GDSC1000.cellid')
+DATASET_PREFIX_RE = r"^([^._]*)"
+# Ordered (pattern, replacement) rules renaming the column name prefixes 
+#>into the names in the dataset table
+CELL_DATASET_RULES = (
+    (r"^GDSC$", "GDSC_v2"),
+    (r"^GDSC1.*$", "GDSC_v1")
+)
+COMPOUND_DATASET_RULES = (
+    (r"GDSC2019", "GDSC_v2"),
+    (r"^GDSC1.*$", "GDSC_v1")
+)
+
+
+@functools.lru_cache(maxsize=1)
+def get_dataset_regex():
+    """
+    Build a regex matching the names of the datasets in procdata, so it is
+    only listed and compiled once for all of the synonym builders. Call 
+    `get_dataset_regex.cache_clear()` if procdata changes between builds.
+
+    @return [`re.Pattern`] Alternation of the dataset names
+    """
+    # The dataset name is everything before the first underscore of a PSet 
+    #>directory; entries starting with '_' or '.' (ex. the '_merged' tables 
+    #>staged by `stage_megafile`) aren't datasets
+    dataset_names = [entry.name.split("_", 1)[0] 
+        for entry in os.scandir("procdata") 
+        if entry.is_dir() and not entry.name.startswith(("_", "."))]
+    return re.compile("|".join(map(re.escape, dataset_names)))
+
+
+def get_dataset_columns(columns, identifier):
+    """
+    @param columns: [`list(string)`] Column names of an annotation file
+    @param identifier: [`string`] Suffix of the identifier columns (ex. 'cellid')
+    @return [`list(string)`] The dataset specific identifier columns (ex. 
+        'CCLE.cellid') for datasets in procdata, excluding 'unique.{identifier}'
+    """
+    is_dataset = get_dataset_regex().match
+    unique_column = f"unique.{identifier}"
+    return [name for name in columns if name.endswith(identifier) and 
+        name != unique_column and is_dataset(name)]
+
+
+def scan_annotations(annotation_file):
+    """
+    Lazily scan an annotation .csv file through a .parquet copy written next 
+    to it, so the CSV is only parsed again when it changes. The copy is shared
+    by every builder reading the same file (ex. cell and tissue synonyms).
+
+    @param annotation_file: [`string`] Path to the annotation .csv file
+    @return [`polars.LazyFrame`] The annotations, with every column read as a 
+        string and 'NA' left as is (see `na_to_null`)
+    """
+    parquet_file = f"{os.path.splitext(annotation_file)[0]}.parquet"
+    if not os.path.exists(parquet_file) or \
+            os.path.getmtime(parquet_file) < os.path.getmtime(annotation_file):
+        csv_to_parquet(annotation_file, parquet_file)
+    return pl.scan_parquet(parquet_file)
+
+
+def csv_to_parquet(csv_file, parquet_file, block_size=16 << 20):
+    """
+    Stream a .csv file into a .parquet file one record batch at a time, so 
+    peak memory is bounded by `block_size` rather than the size of the file.
+
+    @param csv_file: [`string`] Path to the .csv file
+    @param parquet_file: [`string`] Path to write the .parquet file to
+    @param block_size: [`int`] Bytes of the .csv file to parse per batch
+    @return: [`None`]
+    """
+    with open(csv_file, newline="") as file:
+        header = next(csv.reader(file))
+    # Read every column as a string, with only empty fields as null
+    reader = pa_csv.open_csv(csv_file, 
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={name: pa.string() for name in header},
+            null_values=[""], strings_can_be_null=True))
+    with pq.ParquetWriter(parquet_file, reader.schema, 
+            compression="snappy") as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+
+
+def na_to_null(columns):
+    """
+    @param columns: [`list(string)`] Names of string columns
+    @return [`list(polars.Expr)`] Expressions replacing 'NA' with null in columns
+    """
+    return [pl.when(col(name) != "NA").then(col(name)).alias(name) 
+        for name in columns]
+
 # --- SYNONYMS TABLES --------------------------------------------------------------------------
 
+@logger.catch
+def build_all_synonym_dfs(cell_file, compound_file, output_dir):
+    """
+    Build the cell, tissue and compound synonym tables concurrently. The
+    builders share no state and polars releases the GIL, so a thread each is
+    enough to overlap their reads, joins and writes.
+
+    @param cell_file: [`string`] Path to the cell annotation .csv file, which
+        also holds the tissue identifiers
+    @param compound_file: [`string`] Path to the compound annotation .csv file
+    @param output_dir: [`string`] The directory with the PharmacoDB tables
+    @return: [`None`]
+    """
+    # Cache the dataset regex and the parquet copies up front, so the threads
+    #>don't race to write the same file (cell and tissue share cell_file)
+    get_dataset_regex()
+    for annotation_file in {cell_file, compound_file}:
+        scan_annotations(annotation_file)
+
+    builders = [
+        (build_cell_synonym_df, cell_file),
+        (build_tissue_synonym_df, cell_file),
+        (build_compound_synonym_df, compound_file)
+    ]
+    with ThreadPoolExecutor(max_workers=len(builders)) as executor:
+        futures = [executor.submit(builder, annotation_file, output_dir)
+            for builder, annotation_file in builders]
+        for future in futures:
+            future.result()
+
+
 @logger.catch
 def build_cell_synonym_df(cell_file, output_dir):
 
     # Get metadata file and cell_df
-    cell_metadata = pl.read_csv(cell_file, null_values="NA")
-    cell_df = pl.from_arrow(
-        fread(os.path.join(output_dir, "cell.jay")).to_arrow()
-    )
-    dataset_df = pl.from_arrow(
-        fread(os.path.join(output_dir, "dataset.jay")).to_arrow()
-    )
-
-    # Find all columns relevant to cellid
-    cell_cols = [col for col in cell_metadata.columns 
-        if re.match(".*cellid$", col) and col != "unique.cellid"]
-
-    # Read in which datasets we are working with
-    dataset_names = os.listdir("procdata")
-    clean_dataset_names = [re.sub("_.*$", "", name) for name in dataset_names]
-    dataset_regex = re.compile("|".join(clean_dataset_names))
-
-    # Filter the cellid columns to only valid datasets
-    cell_columns = [name for name in cell_cols if 
-        re.match(dataset_regex, name)]
-
-    # Get all unique synonyms and join with cell_df
+    cell_metadata = scan_annotations(cell_file)
+    cell_df = read_table("cell", output_dir, columns=["id", "name"])
+    dataset_df = read_table("dataset", output_dir, columns=["id", "name"])
+
+    # Find the cellid columns of valid datasets
+    cell_columns = get_dataset_columns(cell_metadata.columns, "cellid")
+
+    # Get all unique synonyms and join with cell_df in one lazy query, only
+    #>parsing the identifier columns from the metadata file and keeping only
+    #>the key columns of cell_df on the build side of the join
     cell_meta_long = cell_metadata \
+        .select(["unique.cellid", *cell_columns]) \
+        .with_columns(na_to_null(["unique.cellid", *cell_columns])) \
         .melt(id_vars="unique.cellid", value_vars=cell_columns) \
-        .drop_nulls() \
-        .drop_duplicates() \
+        .filter(col("value").is_not_null() & (col("value").str.len_bytes() > 0)) \
+        .unique() \
         .rename({"value": "cell_name", "variable": "dataset_id"})
-            
-    cell_synonym_df = cell_df \
+
+    cell_synonym_df = cell_df.lazy() \
+        .rename({"id": "cell_id"}) \
         .join(cell_meta_long, left_on="name", right_on="unique.cellid", 
-            how="left") \
-        .drop(["tissue_id", "name"]) \
-        .filter(col("cell_name") != "") \
-        .drop_duplicates() \
-        .rename({"id": "cell_id"})
-
-    # Create a map from dataset
-    dataset_map = {dct["name"]: str(dct["id"]) for dct 
-        in dataset_df.to_pandas().to_dict(orient="record")}
-    # Regex the dataset identifiers to match the dataset map
-    cell_synonym_df["dataset_id"] = cell_synonym_df["dataset_id"] \
-        .apply(lambda x: re.sub("\.cellid$|[_.].*$", "", x)) \
-        .apply(lambda x: re.sub("GDSC$", "GDSC_v2", x)) \
-        .apply(lambda x: re.sub("GDSC1.*$", "GDSC_v1", x)) \
-        .apply(lambda x: dataset_map[x]) \
-        .cast(pl.Int64)
-    
+            how="inner") \
+        .drop("name") \
+        .collect(engine="streaming")
+
+    # Regex the dataset identifiers to match the dataset table, then map them
+    #>to the dataset ids
+    cell_synonym_df = join_dataset_ids(cell_synonym_df, dataset_df, 
+        CELL_DATASET_RULES)
+
     cell_synonym_df = cell_synonym_df \
-        .drop_duplicates() \
+        .unique(subset=["cell_id", "dataset_id", "cell_name"], keep="first", 
+            maintain_order=False) \
         .drop_nulls()
-    cell_synonym_df["id"] = range(1, cell_synonym_df.shape[0] + 1)
-    
-    # Convert to datatable.Frame for fast write to disk
-    cell_synonym_dt = dt.Frame(cell_synonym_df.to_arrow())
-    cell_synonym_dt.to_jay(os.path.join(output_dir, "cell_synonym.jay"))
+    cell_synonym_df = cell_synonym_df.with_columns(
+        pl.int_range(1, pl.len() + 1, dtype=pl.Int32).alias("id"))
+
+    write_table(cell_synonym_df, "cell_synonym", output_dir, add_index=False)
 
 
 @logger.catch
 def build_tissue_synonym_df(tissue_file, output_dir):
     # Get metadata file and tissue_df (assume that tissue_df is also in output_dir)
-    tissue_metadata = pl.read_csv(tissue_file) # will read NA as string!
-    tissue_df = pl.from_arrow(
-        fread(os.path.join(output_dir, "tissue.jay")).to_arrow()
-    )
-    dataset_df = pl.from_arrow(
-        fread(os.path.join(output_dir, "dataset.jay")).to_arrow()
-    )
-
-    # Find all columns relevant to tissueid
-    tissue_cols = [col for col in tissue_metadata.columns 
-        if re.match(".*tissueid$", col) and col != "unique.tissueid"]
-
-    # Read in which datasets we are working with
-    dataset_names = os.listdir("procdata")
-    clean_dataset_names = [re.sub("_.*$", "", name) for name in dataset_names]
-    dataset_regex = re.compile("|".join(clean_dataset_names))
-
-    # Filter the cellid columns to only valid datasets
-    tissue_columns = [name for name in tissue_cols 
-        if re.match(dataset_regex, name)]
-
-    # Get all unique synonyms and join with cell_df
+    tissue_metadata = scan_annotations(tissue_file) # keeps NA as a string!
+    tissue_df = read_table("tissue", output_dir, columns=["id", "name"])
+    dataset_df = read_table("dataset", output_dir, columns=["id", "name"])
+
+    # Find the tissueid columns of valid datasets
+    tissue_columns = get_dataset_columns(tissue_metadata.columns, "tissueid")
+
+    # Get all unique synonyms and join with tissue_df in one lazy query, only
+    #>parsing the identifier columns from the metadata file and keeping only
+    #>the key columns of tissue_df on the build side of the join
     tissue_meta_long = tissue_metadata \
+        .select(["unique.tissueid", *tissue_columns]) \
         .melt(id_vars="unique.tissueid", value_vars=tissue_columns) \
-        .drop_nulls() \
-        .drop_duplicates() \
+        .filter(col("value").is_not_null() & (col("value").str.len_bytes() > 0)) \
+        .unique() \
         .rename({"value": "tissue_name", "variable": "dataset_id"})
-    
-    tissue_synonym_df = tissue_df \
-        .join(tissue_meta_long, left_on="name", right_on="unique.tissueid", how="left") \
-        .drop("name") \
+
+    tissue_synonym_df = tissue_df.lazy() \
         .rename({"id": "tissue_id"}) \
-        .filter(col("tissue_name") != "") \
-        .drop_duplicates() \
-        .drop_nulls()
+        .join(tissue_meta_long, left_on="name", right_on="unique.tissueid", how="inner") \
+        .drop("name") \
+        .collect(engine="streaming")
 
-    # Create a map from dataset
-    dataset_map = {dct["name"]: str(dct["id"]) for dct in 
-        dataset_df.to_pandas().to_dict(orient="record")}
-    # Regex the dataset identifiers to match the dataset map
-    tissue_synonym_df["dataset_id"] = tissue_synonym_df["dataset_id"] \
-        .apply(lambda x: re.sub("\.cellid$|[_.].*$", "", x)) \
-        .apply(lambda x: re.sub("GDSC$", "GDSC_v2", x)) \
-        .apply(lambda x: re.sub("GDSC1.*$", "GDSC_v1", x)) \
-        .apply(lambda x: dataset_map[x]) \
-        .cast(pl.Int64)
+    # Regex the dataset identifiers to match the dataset table, then map them
+    #>to the dataset ids
+    tissue_synonym_df = join_dataset_ids(tissue_synonym_df, dataset_df, 
+        CELL_DATASET_RULES)
 
-    tissue_synonym_df = tissue_synonym_df.drop_duplicates()
-    tissue_synonym_df["id"] = range(1, tissue_synonym_df.shape[0] + 1)
+    tissue_synonym_df = tissue_synonym_df.unique(
+        subset=["tissue_id", "dataset_id", "tissue_name"], keep="first", 
+        maintain_order=False)
+    tissue_synonym_df = tissue_synonym_df.with_columns(
+        pl.int_range(1, pl.len() + 1, dtype=pl.Int32).alias("id"))
 
-    # Convert to datatable.Frame for fast write to disk
-    tissue_synonym_dt = dt.Frame(tissue_synonym_df.to_arrow())
-    tissue_synonym_dt.to_jay(os.path.join(output_dir, "tissue_synonym.jay"))
+    write_table(tissue_synonym_df, "tissue_synonym", output_dir, 
+        add_index=False)
 
 def build_compound_synonym_df(compound_file, output_dir):
     # Get metadata file and compound_df
-    compound_metadata = pl.read_csv(compound_file, null_values="NA")
-    compound_df = pl.from_arrow(
-        fread(os.path.join(output_dir, "compound.jay")).to_arrow()
-    )
-    dataset_df = pl.from_arrow(
-        fread(os.path.join(output_dir, "dataset.jay")).to_arrow()
-    )
-
-    # Find all columns relevant to tissueid
-    compound_cols = [col for col in compound_metadata.columns 
-        if re.match(".*drugid$", col) and col != "unique.drugid"]
-    
-    # Read in which datasets we are working with
-    dataset_names = os.listdir("procdata")
-    clean_dataset_names = [re.sub("_.*$", "", name) for name in dataset_names]
-    dataset_regex = re.compile("|".join(clean_dataset_names))
-
-    # Filter the cellid columns to only valid datasets
-    compound_columns = [name for name in compound_cols 
-        if re.match(dataset_regex, name)]
-
-    # Get all unique synonyms and join with cell_df
+    compound_metadata = scan_annotations(compound_file)
+    compound_df = read_table("compound", output_dir, columns=["id", "name"])
+    dataset_df = read_table("dataset", output_dir, columns=["id", "name"])
+
+    # Find the drugid columns of valid datasets
+    compound_columns = get_dataset_columns(compound_metadata.columns, "drugid")
+
+    # Get all unique synonyms and join with compound_df in one lazy query,
+    #>only parsing the identifier columns from the metadata file and keeping
+    #>only the key columns of compound_df on the build side of the join
     compound_meta_long = compound_metadata \
+        .select(["unique.drugid", *compound_columns]) \
+        .with_columns(na_to_null(["unique.drugid", *compound_columns])) \
         .melt(id_vars="unique.drugid", value_vars=compound_columns) \
-        .drop_nulls() \
-        .drop_duplicates() \
-        .rename({"value": "compound_name", "variable": "dataset_id"}) \
-        .filter(col("compound_name") != "")
+        .filter(col("value").is_not_null() & (col("value").str.len_bytes() > 0)) \
+        .unique() \
+        .rename({"value": "compound_name", "variable": "dataset_id"})
 
-    compound_synonym_df = compound_df \
-        .join(compound_meta_long, left_on="name", right_on="unique.drugid", how="left") \
+    compound_synonym_df = compound_df.lazy() \
         .rename({"id": "compound_id"}) \
-        .select(["compound_id", "dataset_id", "compound_name"]) \
-        .drop_nulls() \
-        .drop_duplicates()
-
-    # Create a map from dataset
-    dataset_map = {dct["name"]: str(dct["id"]) for dct
-        in dataset_df.to_pandas().to_dict(orient="record")}
-    # Regex the dataset identifiers to match the dataset map
-    compound_synonym_df["dataset_id"] = compound_synonym_df["dataset_id"] \
-        .apply(lambda x: re.sub("\.drugid$|[_.].*$", "", x)) \
-        .apply(lambda x: re.sub("GDSC2019", "GDSC_v2", x)) \
-        .apply(lambda x: re.sub("GDSC1.*$", "GDSC_v1", x)) \
-        .apply(lambda x: dataset_map[x]) \
-        .cast(pl.Int64)
+        .join(compound_meta_long, left_on="name", right_on="unique.drugid", how="inner") \
+        .drop("name") \
+        .collect(engine="streaming")
 
-    compound_synonym_df = compound_synonym_df.drop_duplicates()
-    compound_synonym_df["id"] = range(1, compound_synonym_df.shape[0] + 1)
+    # Regex the dataset identifiers to match the dataset table, then map them
+    #>to the dataset ids
+    compound_synonym_df = join_dataset_ids(compound_synonym_df, dataset_df, 
+        COMPOUND_DATASET_RULES)
 
-    # Convert to datatable.Frame for memory mapped output file
-    df = dt.Frame(compound_synonym_df.to_arrow())
-    df.to_jay(os.path.join(output_dir, "compound_synonym.jay"))
+    compound_synonym_df = compound_synonym_df.unique(
+        subset=["compound_id", "dataset_id", "compound_name"], keep="first", 
+        maintain_order=False)
+    compound_synonym_df = compound_synonym_df.with_columns(
+        pl.int_range(1, pl.len() + 1, dtype=pl.Int32).alias("id"))
 
+    write_table(compound_synonym_df, "compound_synonym", output_dir, 
+        add_index=False)
 
 
-## ---- DEPRECATED
-## TODO:: Write new helper methods to reduce repetition
 
-# Helper function for getting all synonyms related to a certain df
-def melt_and_join(meta_df, unique_id, join_df):
+def join_dataset_ids(synonym_df, dataset_df, rules):
     """
-    @param meta_df: [`polars.DataFrame`] The DataFrame containing all the 
-        synonyms (metadata)
-    @param unique_id: [`string`] The name of the column in the metadata 
-        containing the unique IDs
-    @param join_df: [`polars.DataFrame`] The DataFrame containing the primary 
-        keys that will be used as foreign keys in the new synonyms df
-    @return [`polars.DataFrame`] The synonys dataframe, with a PK, FK based on 
-        join_df, and all unique synonyms
+    Clean the metadata column names in the dataset_id column of synonym_df 
+    by extracting their leading token and renaming it with vectorized regex 
+    replacements, then join to dataset_df to replace them with the dataset ids.
+    The string work is done on the distinct column names only (a handful), 
+    so only a single join on the raw names touches every row.
+
+    @param synonym_df: [`polars.DataFrame`] A synonym table with a string 
+        dataset_id column
+    @param dataset_df: [`polars.DataFrame`] The dataset table
+    @param rules: [`tuple(tuple(string, string))`] Ordered (pattern, 
+        replacement) pairs mapping the column name prefixes to dataset names
+    @return [`polars.DataFrame`] synonym_df with an Int64 dataset_id column; 
+        rows whose dataset name has no match in dataset_df are dropped, with
+        a warning
     """
-    # Convert wide meta_df to long table
-    # Drop "variable" col (leave only unique ID and synonyms), drop duplicates
-    synonyms = meta_df \
-        .melt(id_vars=unique_id) \
-        .select([unique_id, "value"]) \
-        .drop_duplicates() \
-        .filter(pl.col("value").is_not_null())
-    # Join with join_df based on unique_id
-    synonyms = synonyms \
-        .join(join_df, left_on=unique_id, right_on="name", how="inner") \
-        .select(["id", "value"])
-    synonym["id"].cast(pl.Int64)
-    return synonyms
-
+    dataset_name = col("dataset_column").str.extract(DATASET_PREFIX_RE, 1)
+    for pattern, replacement in rules:
+        dataset_name = dataset_name.str.replace(pattern, replacement)
+    dataset_ids = dataset_df.select([
+        col("name").alias("dataset_name"),
+        col("id").cast(pl.Int64).alias("dataset_id")
+    ])
+    # Map each distinct metadata column name to its dataset id
+    dataset_map = synonym_df \
+        .select(col("dataset_id").unique().alias("dataset_column")) \
+        .with_columns(dataset_name.alias("dataset_name")) \
+        .join(dataset_ids, on="dataset_name", how="left") \
+        .drop("dataset_name")
+    unmatched = dataset_map.filter(col("dataset_id").is_null())
+    if unmatched.height > 0:
+        logger.warning("No dataset matches the columns "
+            f"{', '.join(unmatched['dataset_column'].to_list())}; "
+            "their synonyms will be dropped!")
+    # The inner join drops the synonyms of the unmatched columns
+    return synonym_df \
+        .rename({"dataset_id": "dataset_column"}) \
+        .join(dataset_map.drop_nulls("dataset_id"), on="dataset_column", 
+            how="inner") \
+        .select(synonym_df.columns)
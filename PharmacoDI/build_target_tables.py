@@ -1,12 +1,13 @@
 import os
-import requests
+import io
+import hashlib
+import time
 import pandas as pd
-import numpy as np
-from multiprocessing import Pool, cpu_count
-from datatable import dt, fread, join, f, g
+from concurrent.futures import ThreadPoolExecutor
 import polars as pl
-from PharmacoDI.combine_pset_tables import write_table, rename_and_key, join_tables
-from PharmacoDI.get_chembl_compound_targets import parallelize
+from PharmacoDI.combine_pset_tables import write_table, read_table, \
+    scan_table_file
+from PharmacoDI.utilities import HTTP_SESSION, ENS_VERSION_RE
 
 # -- Enable logging
 from loguru import logger
@@ -23,6 +24,23 @@ logger_config = {
 }
 logger.configure(**logger_config)
 
+# Parquet cache of the UniProt to ENSEMBL gene ID mappings
+UNIPROT_CACHE_FILE = os.path.join('data', 'cache', 'uniprot_ensembl.parquet')
+
+# Types of the columns read from the DrugBank and ChEMBL target files; 
+#>polars only infers types from the first rows, so an id column that looks
+#>numeric there but holds text further down would fail to parse
+DRUGBANK_SCHEMA = {
+    'name': pl.Utf8,
+    'polypeptide.external.identifiers.UniProtKB': pl.Utf8,
+    'drugName': pl.Utf8
+}
+CHEMBL_SCHEMA = {
+    'pref_name': pl.Utf8,
+    'accession': pl.Utf8,
+    'compound_id': pl.Int64
+}
+
 
 @logger.catch
 def build_target_tables(drugbank_file, chembl_file, output_dir, compound_synonym_file):
@@ -33,24 +51,29 @@ def build_target_tables(drugbank_file, chembl_file, output_dir, compound_synonym
     @param drugbank_file: [`string`] The full file path to Drugbank targets
     @param chembl_file: [`string`] The full file path to ChEMBL targets
     @param output_dir: [`string`] The directory of all final PharmacoDB tables
-    @param compound_synonym_file: [`string`] The file path to the compound synonym table
+    @param compound_synonym_file: [`string`] The file path to the compound synonym
+        table .parquet (or .arrow) file
     @return: None
     """
     # Get Drugbank data
     if not os.path.exists(drugbank_file):
         raise FileNotFoundError(f"The file {drugbank_file} doesn't exist!")
-    drugbank_df = dt.fread(drugbank_file)
-    drugbank_df.names = {
-        'polypeptide.external.identifiers.UniProtKB': 'uniprot_id',
-        'drugName': 'compound_name'
-    }
+    drugbank_df = pl.scan_csv(drugbank_file, 
+            schema_overrides=DRUGBANK_SCHEMA) \
+        .rename({
+            'polypeptide.external.identifiers.UniProtKB': 'uniprot_id',
+            'drugName': 'compound_name'
+        }) \
+        .select(['name', 'uniprot_id', 'compound_name']) \
+        .collect(engine="streaming")
 
     # Get ChEMBL data
     if not os.path.exists(chembl_file):
         raise FileNotFoundError(f"The file {chembl_file} doesn't exist!")
-    chembl_df = dt.fread(chembl_file)
-    chembl_df.names= {'pref_name': 'name', 'accession': 'uniprot_id'}
-    chembl_df.key = chembl_df.names[0]
+    chembl_df = pl.scan_csv(chembl_file, schema_overrides=CHEMBL_SCHEMA) \
+        .rename({'pref_name': 'name', 'accession': 'uniprot_id'}) \
+        .select(['name', 'uniprot_id', 'compound_id']) \
+        .collect(engine="streaming")
 
     target_df = build_target_table(chembl_df, drugbank_df, output_dir)
     build_compound_target_table(chembl_df, drugbank_df, target_df, output_dir, 
@@ -64,113 +87,177 @@ def build_target_table(chembl_df, drugbank_df, output_dir):
     Using data from the Drugbank and ChEMBL drug target files and
     the UniProt API, build the target table.
 
-    @param chembl_df: [`dt.Frame`] The ChEMBL drug target table
-    @param drugbank_df: [`dt.Frame`] The DrugBank drug target table
+    @param chembl_df: [`pl.DataFrame`] The ChEMBL drug target table
+    @param drugbank_df: [`pl.DataFrame`] The DrugBank drug target table
     @param output_dir: [`string`] The file path to write the final target table
-    @return: [`dt.Frame`] The target table
+    @return: [`pl.DataFrame`] The target ids, with the target names renamed to
+        'target_id' for joining (see `rename_and_key`)
     """
-    # Combine ChEMBL and Drugbank tables to make target table
-    target_df = dt.rbind([chembl_df['name'],
-        drugbank_df['name']]).to_pandas()
-    target_df.drop_duplicates(inplace=True)
-    target_df = dt.Frame(target_df)
+    # Combine ChEMBL and Drugbank tables to make target table; keep the first
+    #>occurrence order so target ids are stable between runs
+    target_df = pl.concat([
+            chembl_df.lazy().select('name'),
+            drugbank_df.lazy().select('name')
+        ], how='vertical_relaxed') \
+        .unique(subset=['name'], maintain_order=True) \
+        .collect()
     target_df = write_table(target_df, 'target', output_dir)
-    target_df = rename_and_key(target_df, 'target_id')
-    return target_df
+    return target_df.select(['id', 'name']).rename({'name': 'target_id'})
 
 
 @logger.catch
-def build_compound_target_table(chembl_df, drugbank_df, target_df, output_dir, compound_synonym_file):
+def build_compound_target_table(chembl_df, drugbank_df, target_df, output_dir, compound_synonym_file,
+        force=False):
     """
     Using data from the Drugbank and ChEMBL drug target files and 
     the target table, build the drug target table.
 
-    @param chembl_df: [`dt.Frame`] The ChEMBL drug target table
-    @param drugbank_df: [`dt.Frame`] The DrugBank drug target table
-    @param target_df: [`datatable.Frame`] The target table, keyed
+    @param chembl_df: [`pl.DataFrame`] The ChEMBL drug target table
+    @param drugbank_df: [`pl.DataFrame`] The DrugBank drug target table
+    @param target_df: [`pl.DataFrame`] The target ids (see `build_target_table`)
     @param output_dir: [`string`] The file path with all final PharmacoDB tables
-    @param compound_synonym_file: [`string`] The file path to the compound synonym table
-    @return: [`dt.Frame`] The drug target table
+    @param compound_synonym_file: [`string`] The file path to the compound synonym
+        table .parquet (or .arrow) file
+    @param force: [`bool`] Rewrite the table even if its content is unchanged
+    @return: [`pl.DataFrame`] The drug target table
     """
     # Load compound synonym table from output_dir
     if not os.path.exists(compound_synonym_file):
         raise FileNotFoundError(f"The file {compound_synonym_file} doesn't exist!")
-    drug_syn_df = dt.fread(compound_synonym_file)
-    # Join drugbank df with drug table
-    del drug_syn_df[:, ['dataset_id', 'id']]
-    drug_syn_df = pl.from_arrow(drug_syn_df.to_arrow()) \
-        .drop_duplicates()
-    drugbank_df = pl.from_arrow(drugbank_df[:, ['name', 'compound_name']].to_arrow())
-    drugbank_df = drugbank_df.join(drug_syn_df, on='compound_name')
-    # Combine ChEMBL and Drugbank tables to make drug target table
-    drug_target_df = pd.concat([chembl_df.to_pandas()[['name', 'compound_id']].copy(),
-                                drugbank_df.to_pandas()[['name', 'compound_id']].copy()])
-    drug_target_df.rename(columns={'name': 'target_id'}, inplace=True)
-    drug_target_df.drop_duplicates(inplace=True)
-    # Join with target table
-    drug_target_df = dt.Frame(drug_target_df)
-    drug_target_df = join_tables(drug_target_df, target_df, 'target_id')
-    # Drop rows with no target_id, drop duplicates
-    drug_target_df = drug_target_df[dt.f.target_id >= 1, :]
-    drug_target_df = drug_target_df[0, :, dt.by(drug_target_df.names)]
-    drug_target_df = dt.Frame(
-        pl.from_arrow(drug_target_df.to_arrow()) \
-            .drop_nulls() \
-            .to_arrow())
-    drug_target_df = write_table(
-        drug_target_df, 'compound_target', output_dir, add_index=False)
+    # Join drugbank df with drug table; each synonym must name one compound,
+    #>otherwise the join raises instead of silently fanning out rows. The join
+    #>key is categorical under a shared string cache, so it hashes int codes
+    with pl.StringCache():
+        drug_syn_df = scan_table_file(compound_synonym_file) \
+            .select(['compound_id', 'compound_name']) \
+            .unique() \
+            .with_columns(pl.col('compound_name').cast(pl.Categorical)) \
+            .collect()
+        # The compound ids are cast to the type of the compound table's ids
+        compound_id_type = drug_syn_df.schema['compound_id']
+        drugbank_df = drugbank_df.select(['name', 'compound_name']) \
+            .with_columns(pl.col('compound_name').cast(pl.Categorical))
+        drugbank_df = drugbank_df.join(drug_syn_df, on='compound_name', 
+            how='inner', validate='m:1')
+    # Combine ChEMBL and Drugbank tables to make drug target table, mapping
+    #>target names to ids against the small target table (the hash table is
+    #>built on it) and dropping rows with no target_id or compound_id
+    drug_target_df = pl.concat([
+            chembl_df.lazy().select(['name', 'compound_id']),
+            drugbank_df.lazy().select(['name', 'compound_id'])
+        ], how='vertical_relaxed') \
+        .rename({'name': 'target_id'}) \
+        .join(target_df.lazy().rename({'id': 'target_pk'}), on='target_id', 
+            how='inner') \
+        .select([pl.col('target_pk').alias('target_id'), 
+            pl.col('compound_id').cast(compound_id_type)]) \
+        .drop_nulls() \
+        .unique() \
+        .collect()
+    drug_target_df = write_join_table(drug_target_df, 'compound_target', 
+        output_dir, force)
     return drug_target_df
 
 
 @logger.catch
-def build_gene_target_table(chembl_df, drugbank_df, target_df, output_dir):
+def build_gene_target_table(chembl_df, drugbank_df, target_df, output_dir,
+        uniprot_cache_file=UNIPROT_CACHE_FILE, force=False):
     """
     Build a join table...
 
-    @param chembl_df: [`pd.DataFrame`] The ChEMBL drug target table
-    @param drugbank_df: [`pd.DataFrame`] The DrugBank drug target table
-    @param target_df: [`datatable.Frame`] The target table, keyed
+    @param chembl_df: [`pl.DataFrame`] The ChEMBL drug target table
+    @param drugbank_df: [`pl.DataFrame`] The DrugBank drug target table
+    @param target_df: [`pl.DataFrame`] The target ids (see `build_target_table`)
     @param output_dir: [`string`] The file path with all final PharmacoDB tables
-    @return: [`datatable.Frame`] The gene_target table
+    @param uniprot_cache_file: [`string`] The .parquet file caching UniProt to
+        ENSEMBL gene ID mappings between runs
+    @param force: [`bool`] Rewrite the table even if its content is unchanged
+    @return: [`pl.DataFrame`] The gene_target table, or None if no UniProt
+        IDs could be mapped to ENSEMBL gene IDs
     """
     # Get target-uniprot mappings from ChEMBL and Drugbank tables
-    gene_target_df = pd.concat([chembl_df.to_pandas()[['name', 'uniprot_id']],
-                                drugbank_df.to_pandas()[['name', 'uniprot_id']]])
-    gene_target_df.rename(columns={'name': 'target_id'}, inplace=True)
-    gene_target_df.drop_duplicates(inplace=True)
-
-    # Retrieve Uniprot-ENSEMBL gene ID mappings
-    uniprot_ids = pd.Series(pd.unique(gene_target_df['uniprot_id']))
-    uniprot_ensembl_mappings = pd.concat(
-        parallelize(uniprot_ids, map_uniprot_to_ensembl, 1000))
-    uniprot_ensembl_mappings.drop_duplicates(inplace=True)
-
-    # Join gene_target table with gene table based on uniprot-ensembl mappings
-    gene_target_df = pd.merge(
-        gene_target_df, uniprot_ensembl_mappings, on='uniprot_id')
-    gene_target_df.drop(columns=['uniprot_id'], inplace=True)
-
-    # Load and key the gene table from output_dir
-    gene_file = os.path.join(output_dir, 'gene.jay')
-    if not os.path.exists(gene_file):
-        raise FileNotFoundError(f"There is no gene file in {output_dir}!")
-    gene_df = dt.fread(gene_file, sep=",")
-    gene_df = rename_and_key(gene_df, 'gene_id')
+    gene_target_df = pl.concat([
+            chembl_df.lazy().select(['name', 'uniprot_id']),
+            drugbank_df.lazy().select(['name', 'uniprot_id'])
+        ], how='vertical_relaxed') \
+        .rename({'name': 'target_id'}) \
+        .unique() \
+        .collect()
+
+    # Retrieve Uniprot-ENSEMBL gene ID mappings, only sending each non-empty 
+    #>ID once and as a string (IDs already cached aren't sent at all)
+    uniprot_ids = gene_target_df \
+        .select(pl.col('uniprot_id').cast(pl.Utf8).drop_nulls().unique()) \
+        .filter(pl.col('uniprot_id').str.len_bytes() > 0) \
+        .get_column('uniprot_id') \
+        .to_list()
+    uniprot_ensembl_mappings = get_uniprot_ensembl_mappings(uniprot_ids,
+        uniprot_cache_file)
+    if uniprot_ensembl_mappings is None or uniprot_ensembl_mappings.height == 0:
+        logger.warning('No UniProt to ENSEMBL mappings, skipping the '
+            'gene_target table!')
+        return None
 
-    # Join target table with gene table and target table
-    gene_target_df = dt.Frame(gene_target_df)
-    gene_target_df = join_tables(gene_target_df, gene_df, 'gene_id')
-    gene_target_df = join_tables(gene_target_df, target_df, 'target_id')
+    # Load the gene table from output_dir and the target ids
+    if not any(os.path.exists(os.path.join(output_dir, f'gene.{ext}'))
+            for ext in ('parquet', 'arrow', 'jay')):
+        raise FileNotFoundError(f"There is no gene file in {output_dir}!")
+    gene_df = read_table('gene', output_dir, columns=['id', 'name'])
 
-    # Drop columns that didn't join and drop duplicates
-    gene_target_df = gene_target_df[(
-        dt.f.target_id >= 1) & (dt.f.gene_id >= 1), :]
-    gene_target_df = gene_target_df[0, :, dt.by(gene_target_df.names)]
+    # Join gene_target table with the uniprot-ensembl mappings (on a categorical
+    #>uniprot_id under a shared string cache), then with the gene and target 
+    #>tables (inner joins drop rows that don't match during the probe), then
+    #>drop duplicates, all in one lazy plan
+    with pl.StringCache():
+        uniprot_id = pl.col('uniprot_id').cast(pl.Categorical)
+        gene_target_df = gene_target_df.lazy() \
+            .with_columns(uniprot_id) \
+            .join(uniprot_ensembl_mappings.lazy().with_columns(uniprot_id),
+                on='uniprot_id', how='inner') \
+            .join(gene_df.lazy().rename({'id': 'gene_pk'}), left_on='gene_id',
+                right_on='name', how='inner') \
+            .join(target_df.lazy().rename({'id': 'target_pk'}), on='target_id',
+                how='inner') \
+            .select([pl.col('target_pk').alias('target_id'), 
+                pl.col('gene_pk').alias('gene_id')]) \
+            .unique() \
+            .collect(engine="streaming")
 
-    gene_target_df.to_jay(os.path.join(output_dir, 'gene_target.jay'))
+    gene_target_df = write_join_table(gene_target_df, 'gene_target', 
+        output_dir, force)
     return gene_target_df
 
 
+def write_join_table(df, name, output_dir, force=False):
+    """
+    Write a join table (without a primary key) as .parquet, unless its 
+    content hash matches the one stored next to the .parquet by the last 
+    write. The rows are sorted first, so the hash and the file doesn't depend
+    on the (unordered) output of `unique`.
+
+    @param df: [`pl.DataFrame`] The join table
+    @param name: [`string`] The name of the table
+    @param output_dir: [`string`] The directory to write the table to
+    @param force: [`bool`] Write the table even if its content is unchanged
+    @return: [`pl.DataFrame`] The join table
+    """
+    df = df.sort(df.columns)
+    # Arrow IPC bytes cover both the values and the schema
+    digest = hashlib.blake2b(df.write_ipc(None).getvalue(), 
+        digest_size=16).hexdigest()
+    parquet_file = os.path.join(output_dir, f'{name}.parquet')
+    hash_file = f'{parquet_file}.sha'
+    if not force and os.path.exists(parquet_file) and os.path.exists(hash_file):
+        with open(hash_file) as hash_fh:
+            if hash_fh.read().strip() == digest:
+                logger.info(f'The {name} table is unchanged, skipping write.')
+                return df
+    table = write_table(df, name, output_dir, add_index=False)
+    with open(hash_file, 'w') as hash_fh:
+        hash_fh.write(digest)
+    return table
+
+
 # TODO: fix this:
 """
 2021-08-16T15:08:15.449197+0000 The following gene_ids failed to map:
@@ -201,31 +288,110 @@ def build_gene_target_table(chembl_df, drugbank_df, target_df, output_dir):
 [129 rows x 1 column]
 """
 
-@logger.catch
-def map_uniprot_to_ensembl(uniprot_ids):
+UNIPROT_IDMAPPING_URL = 'https://rest.uniprot.org/idmapping'
+
+
+def get_uniprot_ensembl_mappings(uniprot_ids, cache_file=UNIPROT_CACHE_FILE):
     """
-    Use the UniProt API to retrieve the ENSEMBL gene IDs
-    corresponding to the UniProt IDS.
+    Get the ENSEMBL gene IDs for uniprot_ids, only querying the UniProt API
+    for IDs missing from the .parquet cache_file, which is then updated. Only
+    mapped IDs are cached, so IDs missing from one UniProt response are 
+    queried again on the next run instead of being hidden for good.
 
     @param uniprot_ids: [`list(string)`] A list of UniProt IDs.
-    @return: [`dt.Frame`] A table mapping UniProt IDs to ENSEMBL gene IDs.
+    @param cache_file: [`string`] Path to the .parquet cache of mappings
+    @return: [`pl.DataFrame`] A table mapping UniProt IDs to ENSEMBL gene IDs,
+        without duplicate rows
     """
-    # Make API call
-    params = {
-        'from': 'ID',
-        'to': 'ENSEMBL_ID',
-        'format': 'tab',
-        'query': " ".join(uniprot_ids)
-    }
-    r = requests.get('https://www.uniprot.org/uploadlists/', params=params)
-    # Check that request was successful
-    r.raise_for_status()
-    # Split text into rows (one row per ID) and build df
-    # Exclude first row (header)
-    gene_id_df = pd.DataFrame(r.text.split("\n")[1:])
-    # Split into two columns, UniprotId and EnsemblId
-    gene_id_df = gene_id_df[0].str.split(pat="\t", expand=True)
-    # Drop empty rows and rename columns
-    gene_id_df.dropna(inplace=True)
-    gene_id_df.rename(columns={0: 'uniprot_id', 1: 'gene_id'}, inplace=True)
+    schema = {'uniprot_id': pl.Utf8, 'gene_id': pl.Utf8}
+    if os.path.exists(cache_file):
+        # Older caches also stored unmapped IDs with a null gene_id
+        cache = pl.read_parquet(cache_file).drop_nulls('gene_id')
+    else:
+        cache = pl.DataFrame(schema=schema)
+    missing = set(uniprot_ids).difference(cache['uniprot_id'].to_list())
+    if len(missing) > 0:
+        logger.info(f'Querying UniProt for {len(missing)} uncached IDs...')
+        mapped = pl.from_pandas(map_uniprot_to_ensembl(list(missing)), 
+            schema_overrides=schema).drop_nulls('gene_id')
+        cache = pl.concat([cache, mapped]).unique()
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        cache.write_parquet(cache_file)
+    return cache.filter(pl.col('uniprot_id').is_in(uniprot_ids))
+
+
+def map_uniprot_to_ensembl(uniprot_ids, poll_interval=3, batch_size=100_000,
+        max_workers=4):
+    """
+    Use the UniProt ID mapping API to retrieve the ENSEMBL gene IDs
+    corresponding to the UniProt IDS. The IDs are submitted as mapping jobs
+    of at most `batch_size` IDs (the API limit), which run concurrently on 
+    threads since each one only waits on the network.
+
+    @param uniprot_ids: [`list(string)`] A list of UniProt IDs.
+    @param poll_interval: [`int`] Seconds to wait between job status checks.
+    @param batch_size: [`int`] The maximum number of IDs per mapping job.
+    @param max_workers: [`int`] The maximum number of concurrent jobs.
+    @return: [`pd.DataFrame`] A table mapping UniProt IDs to ENSEMBL gene IDs.
+    """
+    batches = [uniprot_ids[i:i + batch_size] 
+        for i in range(0, len(uniprot_ids), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        gene_id_dfs = list(executor.map(
+            lambda batch: _map_idmapping_batch(batch, poll_interval), batches))
+    gene_id_df = pd.concat(gene_id_dfs, ignore_index=True) if gene_id_dfs \
+        else pd.DataFrame(columns=['uniprot_id', 'gene_id'], dtype=str)
+    # UniProt returns versioned ENSEMBL IDs, while the gene table doesn't
+    gene_id_df['gene_id'] = gene_id_df['gene_id'] \
+        .str.replace(ENS_VERSION_RE, '', regex=True)
     return gene_id_df
+
+
+def _map_idmapping_batch(uniprot_ids, poll_interval, from_db='UniProtKB_AC-ID',
+        to_db='Ensembl', names=('uniprot_id', 'gene_id')):
+    """Run one mapping job on the shared session, returning its results"""
+    job_id = _submit_idmapping(HTTP_SESSION, uniprot_ids, from_db, to_db)
+    _wait_for_idmapping(HTTP_SESSION, job_id, poll_interval)
+    return _fetch_idmapping(HTTP_SESSION, job_id, names)
+
+
+def _submit_idmapping(session, uniprot_ids, from_db='UniProtKB_AC-ID', 
+        to_db='Ensembl'):
+    """Submit a mapping job (UniProtKB to Ensembl by default), returning its job id"""
+    r = session.post(f'{UNIPROT_IDMAPPING_URL}/run', data={
+        'from': from_db,
+        'to': to_db,
+        'ids': ','.join(uniprot_ids)
+    })
+    r.raise_for_status()
+    return r.json()['jobId']
+
+
+def _wait_for_idmapping(session, job_id, poll_interval):
+    """Poll the status of a mapping job until it has finished"""
+    while True:
+        r = session.get(f'{UNIPROT_IDMAPPING_URL}/status/{job_id}', 
+            allow_redirects=False)
+        # Finished jobs redirect to, or directly return, their results
+        if r.status_code == 303:
+            return
+        r.raise_for_status()
+        status = r.json()
+        job_status = status.get('jobStatus', 'FINISHED')
+        if job_status == 'FINISHED':
+            return
+        if job_status not in ('NEW', 'RUNNING'):
+            raise RuntimeError(f'UniProt ID mapping job {job_id} failed: '
+                f'{status}')
+        time.sleep(poll_interval)
+
+
+def _fetch_idmapping(session, job_id, names=('uniprot_id', 'gene_id')):
+    """Stream all results of a finished mapping job into a DataFrame"""
+    r = session.get(f'{UNIPROT_IDMAPPING_URL}/stream/{job_id}', 
+        params={'format': 'tsv'})
+    r.raise_for_status()
+    # Parse the raw bytes with the C tokenizer, naming the columns on read;
+    #>the TSV has no blank rows, so no dropna pass is needed
+    return pd.read_csv(io.BytesIO(r.content), sep='\t', header=0, 
+        usecols=[0, 1], names=list(names), dtype=str, engine='c')
@@ -1,9 +1,7 @@
-import glob
 import os
-import re
-import numpy as np
-import pandas as pd
-from datatable import dt, fread, f, g, join, by, sort, update
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datatable import dt, fread
 import polars as pl
 from polars import col
 
@@ -22,29 +20,47 @@ logger_config = {
 }
 logger.configure(**logger_config)
 
+# Join tables with fewer rows than this are joined with a lookup instead
+# of a hash join (see `join_tables`)
+SMALL_DIM_THRESHOLD = 1024
+
+# How `write_table` writes the final tables
+PARQUET_OPTIONS = {
+    "compression": "zstd",
+    "statistics": True,
+    "row_group_size": 256_000
+}
+
 
 @logger.catch
 def combine_all_pset_tables(
     data_dir: str, 
     output_dir: str, 
-    compound_meta_file: str
+    compound_meta_file: str,
+    validate: bool = False
 ) -> dict:
     """
     Combine all PSet tables into the final PharmacoDB tables.
 
     @param data_dir: [`string`] The file path to read the PSet tables
     @param output_dir: [`string`] The file path to write the final tables
-    @return: [`dict(string: datatable.Frame)`] A dictionary of all some of the
+    @param validate: [`bool`] Log the foreign key values that fail to map
+        in each join (see `join_tables`); off by default since it costs an
+        extra pass over every joined table
+    @return: [`dict(string: polars.DataFrame)`] A dictionary of all some of the
         final tables, with names as keys, to be used for later joins
     """
     logger.info("Combining all PSet tables...")
-    join_dfs = combine_primary_tables(
-        data_dir, 
-        output_dir, 
-        compound_meta_file
-    )
-    combine_secondary_tables(data_dir, output_dir, join_dfs)
-    combine_experiment_tables(data_dir, output_dir, join_dfs)
+    # Share categorical codes between all tables, so join keys cast to 
+    # pl.Categorical (see `categorize_keys`) can be joined across them
+    with pl.StringCache():
+        join_dfs = combine_primary_tables(
+            data_dir, 
+            output_dir, 
+            compound_meta_file
+        )
+        combine_secondary_tables(data_dir, output_dir, join_dfs, validate)
+        combine_experiment_tables(data_dir, output_dir, join_dfs, validate)
 
 
 @logger.catch
@@ -59,292 +75,692 @@ def combine_primary_tables(
 
     @param data_dir: [`string`] The file path to read the PSet tables
     @param output_dir: [`string`] The file path to write the final tables
-    @return: [`dict(string: datatable.Frame)`] A dictionary of all the primary
+    @return: [`dict(string: polars.DataFrame)`] A dictionary of all the primary
         tables, with names as keys
     """
-    # Load, concatenate, and write primary tables to disk
-    tissue_df = load_table("tissue", data_dir)
-    tissue_df = tissue_df[:, :, sort(f.name, na_position="last")]
-    tissue_df = write_table(tissue_df, "tissue", output_dir)
-    gene_df = load_join_write("gene", data_dir, output_dir)
-    dataset_df = load_join_write("dataset", data_dir, output_dir)
+    # Load, concatenate, and write primary tables to disk, unless their PSet
+    #>tables are unchanged since the last run
+    tissue_df = build_or_reuse_table("tissue", data_dir, output_dir,
+        lambda: write_table(
+            load_table("tissue", data_dir)
+                .sort("name", nulls_last=True, maintain_order=True),
+            "tissue", output_dir))
+    # Genes are sorted by name before they get ids, like tissues, so the ids
+    #>follow name order (`map_genes_to_genomic_coordinates` relies on it)
+    gene_df = build_or_reuse_table("gene", data_dir, output_dir,
+        lambda: write_table(
+            load_table("gene", data_dir)
+                .sort("name", nulls_last=True, maintain_order=True),
+            "gene", output_dir))
+    dataset_df = build_or_reuse_table("dataset", data_dir, output_dir,
+        lambda: load_join_write("dataset", data_dir, output_dir))
 
     # Annotate compounds
-    compound_df = load_table("compound", data_dir)
-    compound_meta_df = dt.fread(compound_meta_file)
-    compound_meta_df.names = {"unique.drugid": "name", 
-        "PharmacoDB.uid": "compound_uid"}
+    compound_meta_df = scan_compound_meta(compound_meta_file)
 
     # Add compound_uid to compound table and write to disk
-    compound_meta_df.key = "name"
-    compound_df = compound_df[:, :, dt.join(compound_meta_df)]
-    compound_df = write_table(compound_df, "compound", output_dir)
-
-    # Transform tables to be used for joins
+    compound_df = build_or_reuse_table("compound", data_dir, output_dir,
+        lambda: write_table(
+            load_table("compound", data_dir)
+                .join(compound_meta_df, on="name", how="left",
+                    maintain_order="left"),
+            "compound", output_dir),
+        source_files=[compound_meta_file])
+
+    # Transform tables to be used for joins, once for all the tables
+    # that reference them
     dfs = {}
-    dfs["tissue"] = rename_and_key(tissue_df, "tissue_id")
-    dfs["compound"] = rename_and_key(compound_df, "compound_id")
-    dfs["gene"] = rename_and_key(gene_df, "gene_id")
-    dfs["dataset"] = rename_and_key(dataset_df, "dataset_id")
+    dfs["tissue"] = build_probe_table(
+        rename_and_key(tissue_df, "tissue_id"), "tissue_id")
+    dfs["compound"] = build_probe_table(
+        rename_and_key(compound_df, "compound_id"), "compound_id")
+    dfs["gene"] = build_probe_table(
+        rename_and_key(gene_df, "gene_id"), "gene_id")
+    dfs["dataset"] = build_probe_table(
+        rename_and_key(dataset_df, "dataset_id"), "dataset_id")
     return dfs
 
 
 @logger.catch
-def combine_secondary_tables(data_dir, output_dir, join_dfs):
+def build_or_reuse_table(name, data_dir, output_dir, build, source_files=[]):
+    """
+    Build a primary table with build, or read it back from output_dir if 
+    its sources are unchanged since it was last built. The sources are the
+    PSet tables with name plus source_files; a signature of their paths 
+    and modification times is stored in '{output_dir}/.cache/{name}.sig'.
+
+    @param name: [`string`] The name of the table
+    @param data_dir: [`string`] File path to the directory with all PSet tables
+    @param output_dir: [`string`] The file path to the final tables
+    @param build: [`function`] Builds and writes the table and returns it
+    @param source_files: [`list(string)`] Any other files the table is built from
+    @return: [`polars.DataFrame`] The table, with at least its id and name 
+        columns
+    """
+    files = find_pset_tables(name, data_dir) + list(source_files)
+    signature = hashlib.blake2b(
+        "".join(f"{file_name}:{os.stat(file_name).st_mtime_ns};" 
+            for file_name in files).encode(),
+        digest_size=16).hexdigest()
+    signature_file = os.path.join(output_dir, ".cache", f"{name}.sig")
+    if os.path.exists(signature_file) and \
+            os.path.exists(os.path.join(output_dir, f"{name}.parquet")):
+        with open(signature_file) as signature_fh:
+            if signature_fh.read().strip() == signature:
+                logger.info(f"The {name} table is up to date, reusing it.")
+                return read_table(name, output_dir, columns=["id", "name"])
+    df = build()
+    if df is None:
+        return df
+    os.makedirs(os.path.dirname(signature_file), exist_ok=True)
+    with open(signature_file, "w") as signature_fh:
+        signature_fh.write(signature)
+    return df
+
+
+def scan_compound_meta(compound_meta_file):
+    """
+    Lazily scan the compound annotations, renamed to join with the compound
+    table. The .csv file is parsed once into a .parquet copy written next to 
+    it, which later runs scan instead, until the .csv file changes. The copy
+    keeps the inferred column types, so it has its own suffix rather than 
+    the all string '.parquet' copy from `build_synonym_tables.scan_annotations`.
+
+    @param compound_meta_file: [`string`] Path to the compound annotation .csv
+    @return: [`polars.LazyFrame`] The annotations, keyed by "name" with the
+        PharmacoDB uid in "compound_uid"
+    """
+    parquet_file = \
+        f"{os.path.splitext(compound_meta_file)[0]}.compound_meta.parquet"
+    if not os.path.exists(parquet_file) or \
+            os.path.getmtime(parquet_file) < os.path.getmtime(compound_meta_file):
+        pl.read_csv(compound_meta_file).write_parquet(parquet_file)
+    return pl.scan_parquet(parquet_file) \
+        .rename({"unique.drugid": "name", "PharmacoDB.uid": "compound_uid"})
+
+
+@logger.catch
+def combine_secondary_tables(data_dir, output_dir, join_dfs, validate=False):
     """
     Build all secondary tables, i.e., all tables that have foreign keys corresponding
     to primary keys of primary tables. The function reads PSet tables from 
     data_dir, concatenates and joins them with tables from join_dfs, and 
     writes them to output_dir.
 
-    @param join_dfs: [`dict(string: datatable.Frame)`] A dictionary of all the primary
+    @param join_dfs: [`dict(string: polars.DataFrame)`] A dictionary of all the primary
         tables, with names as keys
     @param data_dir: [`string`] The file path to read the PSet tables
     @param output_dir: [`string`] The file path to write the final tables
-    @return: [`dict(string: datatable.Frame)`] The updated dictionary of join tables
+    @param validate: [`bool`] Log foreign key values that fail to map
+    @return: [`dict(string: polars.DataFrame)`] The updated dictionary of join tables
     """
     # Build cell table and add to join_dfs dictionary
     cell_df = load_join_write(
-        "cell", data_dir, output_dir, ["tissue"], join_dfs)
-    join_dfs["cell"] = rename_and_key(cell_df, "cell_id")
-
-    # Build compound annotation table
-    load_join_write("compound_annotation", data_dir,
-        output_dir, ["compound"], join_dfs, add_index=False)
-    # Build gene annotation table
-    gene_annot_df = load_table("gene_annotation", data_dir)
-    # Join the other way so that genes that got cut out are included back in
-    gene_annot_df.key = "gene_id"
-    gene_annot_df = join_tables(join_dfs["gene"], gene_annot_df, "gene_id")
-    write_table(gene_annot_df, "gene_annotation", output_dir, add_index=False)
-
-    # Build join tables
-    load_join_write("dataset_cell", data_dir, output_dir,
-                    ["dataset", "cell"], join_dfs, add_index=False)
-    load_join_write("dataset_tissue", data_dir, output_dir,
-                    ["dataset", "tissue"], join_dfs, add_index=False)
-    # TODO: temporary workaround for dataset_compound until we standardize 
-    dataset_compound_df = load_table("dataset_compound", data_dir)
-    dataset_compound_df = join_tables(
-        dataset_compound_df, join_dfs["dataset"], "dataset_id")
-    compound_df = join_dfs["compound"].copy()
-    compound_df.names = {"compound_id": "compound_id"}
-    dataset_compound_df = join_tables(
-        dataset_compound_df, compound_df, "compound_id")
-    dataset_compound_df = write_table(
-        dataset_compound_df, "dataset_compound", output_dir, add_index=False)
-
-    # Build other secondary tables
-    load_join_write("mol_cell", data_dir, output_dir,
-                    ["cell", "dataset"], join_dfs)
-    # mol_cells has Kallisto. not sure why. from CTRPv2 (TODO)
-    load_join_write("dataset_statistics", data_dir,
-                    output_dir, ["dataset"], join_dfs)
+        "cell", data_dir, output_dir, ["tissue"], join_dfs, validate=validate)
+    join_dfs["cell"] = build_probe_table(
+        rename_and_key(cell_df, "cell_id"), "cell_id")
+
+    # The rest of the secondary tables only depend on the join tables, so
+    # they are built concurrently; polars releases the GIL while it works
+    tasks = [
+        # (name, foreign_keys, add_index)
+        ("compound_annotation", ["compound"], False),
+        ("dataset_cell", ["dataset", "cell"], False),
+        ("dataset_tissue", ["dataset", "tissue"], False),
+        ("dataset_compound", ["dataset", "compound"], False),
+        ("mol_cell", ["cell", "dataset"], True),
+        # mol_cells has Kallisto. not sure why. from CTRPv2 (TODO)
+        ("dataset_statistics", ["dataset"], True)
+    ]
+    with ThreadPoolExecutor(max_workers=min(8, len(tasks) + 2)) as executor:
+        futures = [
+            executor.submit(load_join_write, name, data_dir, output_dir,
+                foreign_keys, join_dfs, add_index=add_index, validate=validate)
+            for name, foreign_keys, add_index in tasks
+        ]
+        futures.append(executor.submit(
+            combine_gene_annotation_table, data_dir, output_dir, join_dfs,
+            validate))
+        for future in as_completed(futures):
+            future.result()
     return join_dfs
 
 
 @logger.catch
-def combine_experiment_tables(data_dir, output_dir, join_dfs):
+def combine_gene_annotation_table(data_dir, output_dir, join_dfs, 
+        validate=False):
+    """
+    Build the gene annotation table, keeping genes without annotations.
+
+    @param data_dir: [`string`] The file path to read the PSet tables
+    @param output_dir: [`string`] The file path to write the final tables
+    @param join_dfs: [`dict(string: polars.DataFrame)`] The join tables
+    @param validate: [`bool`] Log foreign key values that fail to map
+    @return: [`polars.DataFrame`] The gene annotation table
+    """
+    gene_annot_df = load_table("gene_annotation", data_dir,
+        maintain_order=False)
+    # Join the other way so that genes that got cut out are included back in
+    gene_annot_df = join_tables(join_dfs["gene"], gene_annot_df, "gene_id",
+        validate=validate)
+    return write_table(gene_annot_df, "gene_annotation", output_dir,
+        add_index=False)
+
+
+@logger.catch
+def combine_experiment_tables(data_dir, output_dir, join_dfs, validate=False):
     """
     Load and process experiment table, then use it to build the dose response
     and profile tables. Drop the "name" column from the experiment table before
-    writing to a CSV.
+    writing it.
 
-    @param join_dfs: [`dict(string: datatable.Frame)`]
+    @param join_dfs: [`dict(string: polars.DataFrame)`]
     @param data_dir: [`string`] The file path to the PSet tables
     @param output_dir: [`string`] The file path to the final tables
+    @param validate: [`bool`] Log foreign key values that fail to map
     @return: [`None`]
     """
     # Load all experiments from PSets
-    experiment_df = load_join_write("experiment", data_dir, output_dir, [
-                                    "cell", "compound", "dataset", "tissue"], join_dfs)
+    experiment_df = load_and_join("experiment", data_dir, [
+                                  "cell", "compound", "dataset", "tissue"], join_dfs,
+                                  validate=validate) \
+        .with_row_index("id", offset=1) \
+        .collect(engine="streaming")
     # Don"t write the "name" column
-    experiment_df[:, ["id", "cell_id", "compound_id", "dataset_id", "tissue_id"]] \
-        .to_csv(os.path.join(output_dir, "experiment.jay"))
-    # Rename columns and key experiment table based on experiment name and dataset id
-    experiment_df.names = {"name": "experiment_id"}
-    experiment_df = experiment_df[:, ["id", "experiment_id", "dataset_id"]]
-    experiment_df.key = ("dataset_id", "experiment_id")
-    join_dfs["experiment"] = experiment_df
-    # Nearly the same code as in load_join_write but has special case handling
-    for df_name in ["dose_response", "profile"]:
-        df = load_table(df_name, data_dir)
-        if df_name == "profile":
-            df[dt.f.IC50 > 1e54, dt.update(IC50=1e54)]
-        for fk in ["dataset", "experiment"]:
-            df = join_tables(df, join_dfs[fk], fk+"_id")
-        del df[:, "dataset_id"]
-        write_table(df, df_name, output_dir,
-                    add_index=(df_name == "dose_response"))
+    write_table(
+        experiment_df.select(
+            ["id", "cell_id", "compound_id", "dataset_id", "tissue_id"]),
+        "experiment", output_dir, add_index=False)
+    # Rename columns; experiments are joined on experiment and dataset name,
+    #>as they are in the PSet tables, so the large dose response and profile
+    #>tables are probed once instead of joining the dataset table first
+    join_dfs["experiment"] = build_probe_table(
+        experiment_df.lazy()
+            .select(["id", col("name").alias("experiment_id"), 
+                col("dataset_id").alias("dataset_pk")])
+            .join(join_dfs["dataset"].lazy().rename({"id": "dataset_pk"}),
+                on="dataset_pk", how="inner")
+            .drop("dataset_pk")
+            .collect(),
+        ["dataset_id", "experiment_id"])
+    # dose_response and profile only depend on the join tables, so they are
+    #>joined and written concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(combine_experiment_data_table, df_name, 
+                data_dir, output_dir, join_dfs, validate)
+            for df_name in ["dose_response", "profile"]]
+        for future in as_completed(futures):
+            future.result()
+
+
+@logger.catch
+def combine_experiment_data_table(df_name, data_dir, output_dir, join_dfs,
+        validate=False):
+    """
+    Build the dose response or profile table, which reference experiments.
+    Nearly the same code as in load_join_write but has special case handling.
+
+    @param df_name: [`string`] Either "dose_response" or "profile"
+    @param data_dir: [`string`] The file path to the PSet tables
+    @param output_dir: [`string`] The file path to the final tables
+    @param join_dfs: [`dict(string: polars.DataFrame)`] The join tables,
+        including "experiment"
+    @param validate: [`bool`] Log foreign key values that fail to map
+    @return: [`None`]
+    """
+    df = load_table(df_name, data_dir,
+        maintain_order=(df_name == "dose_response"))
+    # Cap IC50 in the same lazy pass that feeds the join; clip is a single
+    #>min kernel over the column rather than a when/then/otherwise select
+    if df_name == "profile":
+        df = df.with_columns(col("IC50").clip(upper_bound=1e54))
+    df = join_tables(df, join_dfs["experiment"], "experiment_id",
+        on=["dataset_id", "experiment_id"], validate=validate)
+    df = df.drop("dataset_id")
+    # These are the largest tables, so stream them to disk
+    write_table(df, df_name, output_dir,
+        add_index=(df_name == "dose_response"), sink=True)
 
 
 
 @logger.catch
-def load_join_write(name, data_dir, output_dir, foreign_keys=[], join_dfs=None, add_index=True):
+def load_join_write(name, data_dir, output_dir, foreign_keys=[], join_dfs=None, add_index=True,
+        sort_output=False, validate=False):
     """
     Given the name of a table, load all PSet tables of that name from data_dir,
     join them to any foreign key tables (specified by foreign_keys), and write
-    the final combined and joined table to output_dir as a CSV.
+    the final combined and joined table to output_dir. The load, deduplication
+    and joins are chained into one lazy query, so polars can run them in a
+    single pass without materializing each intermediate table.
 
     @param name: [`string`] The name of the table
     @param data_dir: [`string`] File path to the directory with all PSet tables
     @param output_dir: [`string`] The file path to the final tables
     @param foreign_keys: [`list(string)`] An optional list of tables that this table
         needs to be joined with
-    @param join_dfs: [`dict(string: datatable.Frame)`] An optional dictionary of join
+    @param join_dfs: [`dict(string: polars.DataFrame)`] An optional dictionary of join
         tables (for building out foreign keys); keys are table names
     @param add_index: [`bool`] Indicates whether or not to add a primary key (1-nrows)
-        when writing the final table to a .jay
-    @return: [`datatable.Frame`] The final combined and joined table
+        when writing the final table
+    @param sort_output: [`bool`] Sort the rows by the foreign keys before 
+        writing (see `load_and_join`)
+    @param validate: [`bool`] Log foreign key values that fail to map
+    @return: [`polars.DataFrame`] The final combined and joined table
     """
-    df = load_table(name, data_dir)
+    df = load_and_join(name, data_dir, foreign_keys, join_dfs, 
+        maintain_order=add_index, sort_output=sort_output, validate=validate)
+    return write_table(df, name, output_dir, add_index)
+
+
+@logger.catch
+def load_and_join(name, data_dir, foreign_keys=[], join_dfs=None, 
+        maintain_order=True, sort_output=False, validate=False):
+    """
+    Build the lazy query behind `load_join_write`: load all PSet tables named
+    name and join them to their foreign key tables.
+
+    @param name: [`string`] The name of the table
+    @param data_dir: [`string`] File path to the directory with all PSet tables
+    @param foreign_keys: [`list(string)`] An optional list of tables that this table
+        needs to be joined with
+    @param join_dfs: [`dict(string: polars.DataFrame)`] An optional dictionary of join
+        tables (for building out foreign keys); keys are table names
+    @param maintain_order: [`bool`] Whether to keep the PSet row order when 
+        dropping duplicates (see `load_table`)
+    @param sort_output: [`bool`] Sort the rows by the foreign keys, e.g., to
+        diff the output between runs. The database doesn't depend on row 
+        order, and ids are already reproducible when maintain_order is True,
+        so this is off by default
+    @param validate: [`bool`] Log foreign key values that fail to map 
+        (see `join_tables`)
+    @return: [`polars.LazyFrame`] The combined and joined table query
+    """
+    df = load_table(name, data_dir, maintain_order=maintain_order)
+    unjoined = []
     for fk in foreign_keys:
         logger.info(f"Joining {name} table with {fk} table...")
         if fk not in join_dfs:
             raise KeyError(f"The {name} table has the foreign key {fk}_id but \
                             there is no {fk} table in the join tables dictionary.")
-        df = join_tables(df, join_dfs[fk], f"{fk}_id")
+        df = join_tables(df, join_dfs[fk], f"{fk}_id", validate=validate,
+            unjoined=unjoined)
+    log_unjoined(unjoined)
     fk_columns = [f"{fk}_id" for fk in foreign_keys]
-    df = df[:, :, sort(fk_columns)]
-    df = write_table(df, name, output_dir, add_index)
+    if sort_output and len(fk_columns) > 0:
+        df = df.sort(fk_columns, maintain_order=True)
     return df
 
 
 @logger.catch
-def load_table(name, data_dir):
+def load_table(name, data_dir, maintain_order=True):
     """
-    Load all PSet tables with name into a datatable, dropping any duplicate 
-    rows.
-    
+    Lazily load all PSet tables with name into a single polars query,
+    dropping any duplicate rows. The tables are read from the megafile
+    written by `stage_megafile`, so only one file is scanned.
+
     @param name: [`string`] The name of the table
     @param data_dir: [`string`] File path to the directory with all PSet tables
-    @return: [`datatable.Frame`] A datatable containing all rows from all PSets
+    @param maintain_order: [`bool`] Whether to keep the rows in PSet order 
+        when dropping duplicates. Only needed for tables that get a primary
+        key, so the ids are reproducible; otherwise the parallel hash 
+        dedup can return rows in any order.
+    @return: [`polars.LazyFrame`] A query over all rows from all PSets
     """
     logger.info(f"Loading PSet-specific {name} tables from {data_dir}...")
-    # Get all files
-    files = glob.glob(os.path.join(data_dir, "**", f"*{name}.jay"))
-    # Filter so that file path are "{data_dir}/{pset}/{pset}_{name}.jay"
-    files = [file_name for file_name in files if re.search(
-        data_dir + r"/(\w+)/\1_" + name + ".jay$", file_name)]
-    # Read and concatenate tables
-    df = dt.rbind(*dt.iread(files))
-    # Drop duplicates (groups by all columns and
-    # selects only the first row from each group)
-    df = df[0, :, by(df.names)]
-    return df
+    megafile = stage_megafile(name, data_dir)
+    return pl.scan_ipc(megafile).unique(maintain_order=maintain_order)
+
+
+@logger.catch
+def stage_megafile(name, data_dir):
+    """
+    Concatenate all PSet tables with name into one Arrow IPC file,
+    '{data_dir}/_merged/{name}.arrow'. The file is only rewritten when a
+    PSet table (or the set of PSets in data_dir) is newer than it, so
+    reruns skip straight to scanning it.
+
+    The PSet tables are .jay files, which polars can't scan, so each one is
+    read with datatable and streamed into the megafile as Arrow.
+
+    @param name: [`string`] The name of the table
+    @param data_dir: [`string`] File path to the directory with all PSet tables
+    @return: [`string`] The file path to the megafile
+    """
+    files = find_pset_tables(name, data_dir)
+    if len(files) == 0:
+        raise FileNotFoundError(f"No PSet {name} tables were found in "
+            f"{data_dir}!")
+    megafile = os.path.join(data_dir, "_merged", f"{name}.arrow")
+    last_modified = max(os.path.getmtime(file_name)
+        for file_name in files + [data_dir])
+    if os.path.exists(megafile) and \
+            os.path.getmtime(megafile) >= last_modified:
+        return megafile
+    logger.info(f"Staging {len(files)} PSet {name} tables in {megafile}...")
+    os.makedirs(os.path.dirname(megafile), exist_ok=True)
+    # Read the tables concurrently; datatable releases the GIL while it 
+    #>reads and converts them
+    with ThreadPoolExecutor(max_workers=min(16, len(files))) as executor:
+        tables = list(executor.map(
+            lambda file_name: fread(file_name).to_arrow(), files))
+    # Concatenate tables, matching columns by name like datatable.rbind. The
+    #>Arrow buffers are wrapped as they are and kept as separate chunks, so 
+    #>nothing is copied before the sink streams them to the megafile
+    df = pl.concat(
+        [pl.from_arrow(table, rechunk=False).lazy() for table in tables],
+        how="diagonal_relaxed", rechunk=False)
+    # Write to a temporary file first so an interrupted run isn't cached
+    df.sink_ipc(megafile + ".tmp", compression=None)
+    os.replace(megafile + ".tmp", megafile)
+    return megafile
+
+
+def find_pset_tables(name, data_dir):
+    """
+    Find the PSet tables with name, i.e., every "{data_dir}/{pset}/{pset}_{name}.jay"
+    file. Only the PSet directories are listed, with a single scandir, 
+    instead of globbing data_dir recursively and filtering the matches.
+
+    @param name: [`string`] The name of the table
+    @param data_dir: [`string`] File path to the directory with all PSet tables
+    @return: [`list(string)`] The sorted file paths
+    """
+    files = [os.path.join(entry.path, f"{entry.name}_{name}.jay")
+        for entry in os.scandir(data_dir) if entry.is_dir()]
+    return sorted(file_name for file_name in files if os.path.isfile(file_name))
+
+
+def drop_duplicate_rows(df, subset=None):
+    """
+    Drop duplicate rows from df with a single hash pass, keeping the first
+    occurrence of each row in order (instead of grouping by every column, 
+    which also sorts the table).
+
+    @param df: [`datatable.Frame`] A table
+    @param subset: [`list(string)`] The columns that identify a row, 
+        defaults to all columns
+    @return: [`datatable.Frame`] The table without duplicate rows
+    """
+    return dt.Frame(pl.from_arrow(df.to_arrow())
+        .unique(subset=subset, keep="first", maintain_order=True).to_arrow())
 
 
 @logger.catch
 def fread_table_for_all_psets(
     table_name: str,
-    data_dir: str,
+    data_dir: str, 
     column_dict: dict,
     rename_dict: dict = None,
     key_columns: list = None
 ) -> dt.Frame:
     """
     Reads all tables named `table_name` from `data_dir`, using `column_dict`
-    to specify the column names, order and types to read in. The resulting
-    table iterator is then concatenated using `datatable.rbind` and the
+    to specify the column names, order and types to read in. The tables are
+    read concurrently, then concatenated using `datatable.rbind` and the
     columns are renamed according to rename dict.
-    
+
     :param table_name:
     :param data_dir:
     :param column_dict:
     :param rename_dict:
     """
     logger.info(f"Loading PSet-specific {table_name} tables from {data_dir}...")
-    # Get all files
-    files = glob.glob(os.path.join(data_dir, "**", f"*{table_name}.jay"))
-    # Filter so that file path are "{data_dir}/{pset}/{pset}_{name}.jay"
-    files = [file_name for file_name in files if re.search(
-        data_dir + r"/(\w+)/\1_" + table_name + ".jay$", file_name)]
-    # Read and concatenate tables
-    df = dt.rbind(*dt.iread(files, columns=column_dict), force=True)
-    # Drop duplicates (groups by all columns and
-    # selects only the first row from each group)
-    df = df[0, :, by(df.names)]
+    files = find_pset_tables(table_name, data_dir)
+    # Read the tables concurrently (like `stage_megafile`), instead of one
+    #>at a time with datatable.iread, then concatenate them
+    with ThreadPoolExecutor(max_workers=min(16, len(files) or 1)) as executor:
+        tables = list(executor.map(
+            lambda file_name: fread(file_name, columns=column_dict), files))
+    df = dt.rbind(*tables, force=True)
     if rename_dict is not None:
         df.names = rename_dict
-    if key_columns is not None:
-        df = df[0, :, :, by(key_columns)]
+    # Keeping the first row per key also drops fully duplicated rows
+    df = drop_duplicate_rows(df, key_columns)
     return df
 
 
 @logger.catch
 def rename_and_key(df, join_col, og_col="name"):
     """
-    Prepare df to be joined with other tables by renaming the column
-    on which it will be joined and by keying it.
+    Prepare df to be joined with other tables by selecting its primary key
+    and renaming the column on which it will be joined. Polars joins don't
+    need a keyed table, so the name is kept for backwards compatibility. 
+    The join column is dictionary encoded once here (see `categorize_keys`),
+    so every table joined to it compares integer codes.
 
-    @param df: [`datatable.Frame`] The table to be keyed.
+    @param df: [`polars.DataFrame`] The table to be renamed.
     @param join_col: [`string`] The name of the join column in other tables
                             (ex. "tissue_id", "cell_id", etc.)
     @param og_col: [`string`] The name of the join column in the join table
-    @return: [`datatable.Frame`] The keyed and renamed table
+    @return: [`polars.DataFrame`] The renamed table with only id and join_col
     """
     # Rename primary key to match foreign key name (necessary for joins)
-    df.names = {og_col: join_col}
-    # Only select necessary columns
-    df = df[:, ["id", join_col]]
-    # Set the key
-    df.key = join_col
+    return categorize_keys(df.select(["id", col(og_col).alias(join_col)]),
+        join_col)
+
+
+@logger.catch
+def build_probe_table(df, key_columns):
+    """
+    Prepare a join table (see `rename_and_key`) once, so every table that
+    references it probes the same contiguous frame. Rows with a missing
+    key can never be joined, so they are dropped, and like keying a 
+    datatable, duplicate keys are an error (otherwise the join would 
+    silently repeat rows of the other table).
+
+    @param df: [`polars.DataFrame`] The join table (ex. tissue table)
+    @param key_columns: [`string` or `list(string)`] The column(s) other
+        tables are joined on (ex. "tissue_id")
+    @return: [`polars.DataFrame`] The join table, in a single chunk
+    """
+    df = categorize_keys(df, key_columns).drop_nulls(key_columns).rechunk()
+    if df.select(key_columns).is_duplicated().any():
+        raise ValueError(f"The join table keyed on {key_columns} has "
+            "duplicate keys!")
     return df
 
 
+def categorize_keys(df, key_columns):
+    """
+    Cast the string key columns of df to pl.Categorical, so joins hash
+    their integer codes instead of the strings. The codes only match 
+    between tables inside a `polars.StringCache` (`combine_all_pset_tables`
+    enables one for the whole run); outside of one, categorical key 
+    columns are cast back to strings instead, so the join still works when
+    the combine functions are called on their own.
+
+    @param df: [`polars.DataFrame` or `polars.LazyFrame`] A table
+    @param key_columns: [`string` or `list(string)`] The join columns
+    @return: [`polars.DataFrame` or `polars.LazyFrame`] The same table, with
+        string key columns cast to pl.Categorical
+    """
+    if isinstance(key_columns, str):
+        key_columns = [key_columns]
+    schema = df.collect_schema()
+    if not pl.using_string_cache():
+        return df.with_columns([col(key).cast(pl.Utf8)
+            for key in key_columns if schema[key] == pl.Categorical])
+    return df.with_columns([col(key).cast(pl.Categorical)
+        for key in key_columns if schema[key] == pl.Utf8])
+
+
 @logger.catch
 def join_tables(
-    df1: dt.Frame, 
-    df2: dt.Frame,
+    df1: pl.LazyFrame,
+    df2: pl.DataFrame,
     join_col: str, 
-    delete_unjoined=True
-) -> None:
+    delete_unjoined=True,
+    on: list = None,
+    validate: bool = False,
+    unjoined: list = None
+) -> pl.LazyFrame:
     """
-    Join df2 and df1 based on join_col (left outer join by default).
-
-    @param df1: [`datatable.Frame`] The datatable with the foreign key
-    @param df2: [`datatable.Frame`] The join table (ex. tissue datatable)
+    Join df2 and df1 based on join_col (left outer join by default), replacing
+    the values of join_col in df1 with the ids from df2. The join is lazy, so
+    chained joins are run together when the result is collected. Small join
+    tables (see `SMALL_DIM_THRESHOLD`) from `rename_and_key` are looked up
+    by mapping join_col to the ids directly, without building a hash table.
+
+    @param df1: [`polars.LazyFrame`] The table with the foreign key
+    @param df2: [`polars.DataFrame`] The join table (ex. tissue table)
     @param join_col: [`string`] The name of the columns on which the tables
         will be joined (ex. "tissue_id")
     @param delete_unjoined: [`bool`] An optional parameter (default=True)
         that lets you keep rows in df1 which didn"t join to any rows in df2
-    @return [`datatable.Frame`] The new, joined table
+    @param on: [`list(string)`] The columns to join on, if not only join_col
+        (ex. ["dataset_id", "experiment_id"])
+    @param validate: [`bool`] Log the join_col values that fail to map. This
+        is a diagnostic that costs an extra pass over df1, so it is off by
+        default; unmapped rows are still deleted (or kept) either way
+    @param unjoined: [`list`] If passed, the query for the join_col values
+        that fail to map is appended to it, to be run later together with 
+        the checks for other joins (see `log_unjoined`), instead of now
+    @return [`polars.LazyFrame`] The new, joined table
     """
-    if (join_col not in df1.names) or (join_col not in df2.names):
-        logger.info(f"{join_col} is missing from one or both of the datatables " 
+    if on is None:
+        on = [join_col]
+    is_small_dim = isinstance(df2, pl.DataFrame) and \
+        df2.columns == ["id", join_col] and df2.height < SMALL_DIM_THRESHOLD
+    df1 = df1.lazy()
+    df2 = df2.lazy()
+    if (join_col not in df1.collect_schema().names()) or \
+            (join_col not in df2.collect_schema().names()):
+        logger.info(f"{join_col} is missing from one or both of the tables "
             "passed! Make sure you have prepared df2 using rename_and_key().")
         return None
-    df = df1[:, :, dt.join(df2)]
+    if is_small_dim:
+        # Look up the keys with the same type they have in df1
+        df2 = df2.with_columns(
+            col(join_col).cast(df1.collect_schema()[join_col]))
+    else:
+        df1 = categorize_keys(df1, on)
+        df2 = categorize_keys(df2, on)
     # Check to see if any FKs are null
-    if df[dt.isna(df[:, "id"]), :].nrows > 0:
-        logger.info(f"The following {join_col}s failed to map:")
-        unmatched = df[dt.isna(df[:, "id"]), join_col].copy()
-        unmatched = unmatched[0, :, dt.by(join_col)]
-        logger.info(unmatched)
-        if delete_unjoined:
-            logger.info(f"Rows with these {join_col}s will be deleted!")
-            del df[dt.isna(df[:, "id"]), :]
-    # Rename the join col and drop it
-    df.names = {join_col: "drop", "id": join_col}
-    del df[:, "drop"]
-    return df
+    if validate:
+        check = (join_col, df1.join(df2, on=on, how="anti")
+            .select(join_col)
+            .unique(maintain_order=True))
+        if unjoined is None:
+            log_unjoined([check], delete_unjoined)
+        else:
+            unjoined.append(check)
+    if is_small_dim:
+        ids = df2.collect()
+        df = df1.with_columns(col(join_col)
+            .replace_strict(ids[join_col], ids["id"], default=None)
+            .alias("id"))
+    else:
+        df = df1.join(df2, on=on, how="left", maintain_order="left")
+    if delete_unjoined:
+        df = df.filter(col("id").is_not_null())
+    # Replace the join col with the ids
+    return df.drop(join_col).rename({"id": join_col})
+
+
+def log_unjoined(checks, delete_unjoined=True):
+    """
+    Run the queries for foreign key values that failed to map (see 
+    `join_tables`) in one batch, so polars can run them in parallel and 
+    share the work they have in common, then log any values found.
+
+    @param checks: [`list(tuple(string, polars.LazyFrame))`] The join column
+        and unmatched values query of each join
+    @param delete_unjoined: [`bool`] Whether the unmatched rows were deleted
+    @return: [`None`]
+    """
+    if len(checks) == 0:
+        return
+    results = pl.collect_all([query for _, query in checks])
+    for (join_col, _), unmatched in zip(checks, results):
+        if unmatched.height > 0:
+            logger.info(f"The following {join_col}s failed to map:")
+            logger.info(unmatched)
+            if delete_unjoined:
+                logger.info(f"Rows with these {join_col}s will be deleted!")
 
 
 @logger.catch
-def write_table(df, name, output_dir, add_index=True):
+def write_table(df, name, output_dir, add_index=True, sink=False):
     """
-    Add a primary key to df ("id" column) and write it to output_dir
-    as a .jay file.
-
-    @param df: [`datatable.Frame`] A PharmacoDB table
+    Add a primary key to df ("id" column, 1-nrows) and write it to output_dir
+    as a Parquet file ('{name}.parquet'), zstd compressed with column 
+    statistics. polars dictionary encodes repetitive columns, which keeps 
+    string keys and names small, and downstream readers can skip row groups
+    using the statistics.
+
+    @param df: [`polars.DataFrame` or `polars.LazyFrame`] A PharmacoDB table,
+        lazy queries are collected first unless sink is True
     @param name: [`string`] The name of the table
     @param output_dir: [`string`] The directory to write the table to
-    @return: [`datatable.Frame`] The indexed PharmacoDB table
+    @param add_index: [`bool`] Whether to add the primary key
+    @param sink: [`bool`] Stream a lazy query to the file in batches instead 
+        of collecting it, so the whole table is never held in memory. Use it
+        for large tables that aren't needed afterwards.
+    @return: [`polars.DataFrame`] The indexed PharmacoDB table, or None if
+        it was streamed to the file
     """
     logger.info(f"Writing {name} table to {output_dir}...")
+    if sink and isinstance(df, pl.LazyFrame):
+        if add_index:
+            df = df.with_row_index("id", offset=1)
+        df.sink_parquet(os.path.join(output_dir, f"{name}.parquet"), 
+            **PARQUET_OPTIONS)
+        return None
+    if isinstance(df, pl.LazyFrame):
+        df = df.collect(engine="streaming")
     if add_index:
-        # Index datatable
-        df[:, update(id=np.arange(df.nrows) + 1)]
-    df.to_jay(os.path.join(output_dir, f"{name}.jay"))
+        df = df.with_row_index("id", offset=1)
+    df.write_parquet(os.path.join(output_dir, f"{name}.parquet"),
+        **PARQUET_OPTIONS)
     return df
 
+
+def scan_table_file(file_path):
+    """
+    Lazily scan a PharmacoDB table file, for code that takes file paths; 
+    both Parquet files (see `write_table`) and Arrow IPC files are supported.
+
+    @param file_path: [`string`] The path to the .parquet or .arrow file
+    @return: [`polars.LazyFrame`] The table
+    """
+    if file_path.endswith(".parquet"):
+        return pl.scan_parquet(file_path)
+    return pl.scan_ipc(file_path, memory_map=False)
+
+
+def fread_table(file_path):
+    """
+    Read a PharmacoDB table file into a datatable, for code that takes file
+    paths. Parquet and Arrow IPC files (see `scan_table_file`) are read with 
+    polars; anything else (.jay, .csv) with `datatable.fread`.
+
+    @param file_path: [`string`] The path to the table file
+    @return: [`datatable.Frame`] The table
+    """
+    if file_path.endswith((".parquet", ".arrow")):
+        return dt.Frame(scan_table_file(file_path).collect().to_arrow())
+    return fread(file_path)
+
+
+def read_table(name, output_dir, columns=None):
+    """
+    Read a PharmacoDB table from output_dir into polars from the Parquet file 
+    ('{name}.parquet') written by `write_table`, reading only the projected 
+    columns. Tables from older runs may only exist as an Arrow IPC file 
+    ('{name}.arrow'), which is memory mapped, or as a .jay file, which is 
+    parsed with datatable on every read; nothing is written next to them.
+
+    @param name: [`string`] The name of the table
+    @param output_dir: [`string`] The directory with the PharmacoDB tables
+    @param columns: [`list(string)`] The columns to read, defaults to all
+    @return: [`polars.DataFrame`] The PharmacoDB table
+    """
+    parquet_file = os.path.join(output_dir, f"{name}.parquet")
+    if os.path.exists(parquet_file):
+        return pl.read_parquet(parquet_file, columns=columns)
+    ipc_file = os.path.join(output_dir, f"{name}.arrow")
+    jay_file = os.path.join(output_dir, f"{name}.jay")
+    if not os.path.exists(ipc_file) and os.path.exists(jay_file):
+        df = pl.from_arrow(fread(jay_file).to_arrow())
+        return df if columns is None else df.select(columns)
+    return pl.read_ipc(ipc_file, columns=columns, memory_map=True)
@@ -1,19 +1,18 @@
 import pandas as pd
-import wget
+from .download_psets import _download_all
 
-def download_canonical_psets(save_dir, api_url= "https://www.orcestra.ca/api/psets/canonical"):
+def download_canonical_psets(save_dir, api_url= "https://www.orcestra.ca/api/psets/canonical",
+        max_workers=8):
     """
     Download the specified canonical PSets from the specified api_url
 
     :param save_dir: [string] Path to save the PSets in
     :param api_url: [string] URL where available PSets can be retrieved. Defaults to current Orcestra API.
-    :return: [None] Downloads PSet .rds files into save_dir using wget.
+    :param max_workers: [int] How many PSets to download at the same time. Defaults to 8.
+    :return: [None] Downloads PSet .rds files into save_dir.
     """
     pset_df = pd.read_json(api_url)
     url_dict = pset_df.set_index('name').to_dict()['downloadLink']
-
-    for name, url in url_dict.items():
-        print("Downloading", name, "from", url, sep=" ")
-        wget.download(url, save_dir + "/" + name + '.rds')
+    _download_all(url_dict, save_dir, max_workers)
 
     return None
@@ -1,15 +1,22 @@
+import os
 import pandas as pd
-import wget
+from concurrent.futures import ThreadPoolExecutor
+from .utilities import HTTP_SESSION
 
+# Bytes written per write call when saving a PSet (4 MiB)
+DOWNLOAD_CHUNK_SIZE = 1 << 22
 
-def download_psets(names, save_dir, api_url="https://www.orcestra.ca/api/psets/available"):
+
+def download_psets(names, save_dir, api_url="https://www.orcestra.ca/api/psets/available",
+        max_workers=8):
     """
     Download the specified PSets from the specified api_url
 
     :param names: [list] Names of PSets to download. Must match the 'names' in the api call JSON.
     :param save_dir: [string] Path to save the PSets in
     :param api_url: [string] URL where available PSets can be retrieved. Defaults to current Orcestra API.
-    :return: [None] Downloads PSet .rds files into save_dir using wget.
+    :param max_workers: [int] How many PSets to download at the same time. Defaults to 8.
+    :return: [None] Downloads PSet .rds files into save_dir.
     """
     pset_df = pd.read_json(api_url)
     names = pd.Series(names)
@@ -19,8 +26,40 @@ def download_psets(names, save_dir, api_url="https://www.orcestra.ca/api/psets/a
         raise ValueError(names[~names.isin(pset_df.name)] + 'are not valid pset names')
     pset_df = pset_df[pset_df.name.isin(names)]
     url_dict = pset_df.set_index('name').to_dict()['downloadLink']
-    for name, url in url_dict.items():
-        print("Downloading", name, "from", url, sep=" ")
-        wget.download(url, save_dir + "/" + name + '.rds')
+    _download_all(url_dict, save_dir, max_workers)
 
     return None
+
+
+def _download_all(url_dict, save_dir, max_workers=8):
+    """
+    Download each PSet in url_dict to save_dir, several at a time. Each
+    download is network bound and waits on a single connection, so threads
+    overlap them. The responses are streamed to disk in large chunks, so 
+    each multi-GB .rds file takes few write calls (wget.download copies it
+    8 KiB at a time).
+
+    :param url_dict: [dict] Download URLs, keyed by PSet name.
+    :param save_dir: [string] Path to save the PSets in
+    :param max_workers: [int] How many PSets to download at the same time.
+    :return: [None] Downloads PSet .rds files into save_dir.
+    """
+    def download(name, url):
+        print("Downloading", name, "from", url, sep=" ")
+        file_path = os.path.join(save_dir, name + '.rds')
+        with HTTP_SESSION.get(url, stream=True) as response:
+            response.raise_for_status()
+            # Write to a temporary file so a failed download isn't mistaken
+            #>for a PSet
+            with open(file_path + '.tmp', 'wb') as fh:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    fh.write(chunk)
+        os.replace(file_path + '.tmp', file_path)
+        print("Downloaded", name, sep=" ")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(download, name, url)
+            for name, url in url_dict.items()]
+        # Re-raise the first failed download, if any
+        for future in futures:
+            future.result()
@@ -1,6 +1,5 @@
 from chembl_webresource_client.new_client import new_client
-import multiprocessing as mp
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import re
 import os
@@ -45,13 +44,15 @@ def get_chembl_compound_target_mappings(drug_annotation_file, target_file, drug_
     # Get ChEMBL drugs with matching inchikeys
     logger.info('Getting all drugs from ChEMBL...')
     chembl_drug_df = pd.concat(parallelize(
-        inchikeys, get_drugs_by_inchikey, 50))
+        inchikeys, get_drugs_by_inchikey, 50), ignore_index=True, copy=False)
     chembl_drug_df = pd.merge(
         drug_df[['compound_id', 'inchikey']], chembl_drug_df, on='inchikey', how='inner')
     updated_drug_df = pd.merge(drug_df, chembl_drug_df, 
         on=['inchikey', 'compound_id'], how='left')
     chembl_drug_df.drop(columns='inchikey', inplace=True)
-    molecule_ids = list(chembl_drug_df['molecule_chembl_id'])
+    # Compounds sharing an inchikey map to the same molecule, so only query
+    #>each molecule once
+    molecule_ids = list(pd.unique(chembl_drug_df['molecule_chembl_id']))
 
     # Write updated compound_annotations to disk
     logger.info(f'Writing updated compound_annotation table to {drug_annotation_file}')
@@ -67,8 +68,7 @@ def get_chembl_compound_target_mappings(drug_annotation_file, target_file, drug_
     
     target_df = pd.read_csv(target_file, index_col=0)
     target_df = target_df[['target_chembl_id',
-        'pref_name', 'target_type', 'accession']].copy()
-    target_df.drop_duplicates(inplace=True)
+        'pref_name', 'target_type', 'accession']].drop_duplicates()
     target_ids = list(pd.unique(target_df['target_chembl_id']))
 
     # Get mappings between drugs (molecule_ids) and targets (target_ids)
@@ -76,14 +76,17 @@ def get_chembl_compound_target_mappings(drug_annotation_file, target_file, drug_
     logger.info('Getting drug-target mappings from ChEMBL...')
     drug_target_mappings = parallelize(
         molecule_ids, get_drug_target_mappings, 50, target_ids)
-    drug_target_df = pd.concat(drug_target_mappings).drop_duplicates()
+    # Each chunk is already unique and the chunks hold disjoint molecules, so
+    #>the concatenated mappings don't need another dedup
+    drug_target_df = pd.concat(drug_target_mappings, ignore_index=True, 
+        copy=False)
     drug_target_df = pd.merge(
         drug_target_df, chembl_drug_df, on='molecule_chembl_id')
     drug_target_df = pd.merge(drug_target_df, target_df, on='target_chembl_id')
 
     # Reorder columns and write to .csv
     drug_target_df = drug_target_df[['compound_id', 'molecule_chembl_id', 
-        'target_chembl_id', 'pref_name', 'accession', 'target_type']].copy()
+        'target_chembl_id', 'pref_name', 'accession', 'target_type']]
     drug_target_df.to_csv(drug_target_file)
     return drug_target_df
 
@@ -92,24 +95,25 @@ def get_chembl_compound_target_mappings(drug_annotation_file, target_file, drug_
 @logger.catch
 def parallelize(queries, operation, chunksize, *args):
     """
-    Splits queries into chunks of chunksize and then uses a pool to 
-    parallelize operation on the query chunks.
-    :queries: list of arguments passed to function (in tuples)
+    Splits queries into chunks of chunksize and then uses a thread pool to 
+    parallelize operation on the query chunks. The operations are HTTP 
+    requests, which release the GIL while waiting, so threads avoid forking 
+    processes and pickling each chunk and its results.
+    :queries: list or np.ndarray of arguments passed to function (in tuples);
+        chunks of an array are views, so pd.unique results can be passed as is
     :operation: function being parallelized
     :chuksize: integer representing how many queries each process should handle
     :return: list of results for each query chunk
     """
     chunked_queries = [queries[i:i+chunksize]
-                       for i in np.arange(0, len(queries), chunksize)]
-    pool = mp.Pool(mp.cpu_count())
-    # If operation requires extra args, use pool.starmap instead of pool.map
-    if args:
-        for i in range(len(chunked_queries)):
-            chunked_queries[i] = (chunked_queries[i], *args)
-        results = pool.starmap(operation, chunked_queries)
-    else:
-        results = pool.map(operation, chunked_queries)
-    pool.close()
+                       for i in range(0, len(queries), chunksize)]
+    # The workers mostly wait on the network, so size the pool by the number
+    #>of chunks rather than the number of cores
+    max_workers = min(32, len(chunked_queries)) or 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Pass any extra args to every call of operation
+        results = list(executor.map(
+            lambda chunk: operation(chunk, *args), chunked_queries))
     return results
 
 
@@ -121,20 +125,18 @@ def get_drugs_by_inchikey(inchikeys):
     :inchikeys: A list of inchikeys
     :return: A dataframe of drugs (including ChEMBL ID and inchikey)
     """
-    chembl_drug_df = pd.DataFrame(columns=['inchikey', 'molecule_chembl_id'])
     # Initiate connection to ChEMBL molecule table
     molecule = new_client.molecule
     molecules = molecule \
         .filter(
             molecule_structures__standard_inchi_key__in=inchikeys) \
         .only(['molecule_chembl_id', 'molecule_structures'])
-    for mol in molecules:
-        inchikey = mol['molecule_structures']['standard_inchi_key']
-        chembl_drug_df = chembl_drug_df \
-            .append({'inchikey': inchikey, 
-                'molecule_chembl_id': mol['molecule_chembl_id']},
-                ignore_index=True)
-    return chembl_drug_df
+    # Collect the rows and build the DataFrame once; appending to it in the
+    #>loop copies the whole frame for every molecule
+    records = [{'inchikey': mol['molecule_structures']['standard_inchi_key'],
+        'molecule_chembl_id': mol['molecule_chembl_id']} for mol in molecules]
+    return pd.DataFrame.from_records(records, 
+        columns=['inchikey', 'molecule_chembl_id'])
 
 
 @logger.catch
@@ -145,7 +147,7 @@ def get_drug_target_mappings(molecule_ids, target_ids):
 
     :molecule_ids: A list of ChEMBL drug IDs
     :target_ids: A list of ChEMBL target IDs
-    :return: A DataFrame of drug target mappings (molecule ChEMBL ID and target ChEMBL ID)
+    :return: A DataFrame of unique drug target mappings (molecule ChEMBL ID and target ChEMBL ID)
     """
     # Initiate connection to ChEMBL activity table
     activity = new_client.activity
@@ -156,5 +158,8 @@ def get_drug_target_mappings(molecule_ids, target_ids):
             pchembl_value__isnull=False
         ).only(['molecule_chembl_id', 'target_chembl_id'])
     mappings = list(results)
-    df = pd.DataFrame(mappings)
+    # ChEMBL returns one row per activity, so drop repeated pairs while the
+    #>chunk is small
+    df = pd.DataFrame(mappings, 
+        columns=['molecule_chembl_id', 'target_chembl_id']).drop_duplicates()
     return df
@@ -20,22 +20,21 @@ def get_chembl_targets(target_file):
     results = list(target_result)
     target_df = pd.DataFrame(results)
 
-    # Explode list-like columns into separate rows, duplicating the index
-    object_columns = target_df.dtypes[target_df.dtypes ==
-                                      'object'].index.values
-    for column in object_columns:
-        target_df = target_df.explode(column)
+    # Explode the list columns into separate rows; the other object columns
+    #>hold scalars, so exploding them only copies the frame
+    target_df = target_df \
+        .explode('cross_references') \
+        .explode('target_components')
 
-    # Drop any targets without cross refs
-    target_df = target_df.query("cross_references.notna()").copy()
+    # Drop any targets without cross refs, then give each row its own index
+    #>so the expanded columns line up by position
+    target_df = target_df[target_df['cross_references'].notna()] \
+        .reset_index(drop=True)
 
     # Expand cols with dtype dict into their cols for each key
     for col in ['cross_references', 'target_components']:
-        dict_col = pd.json_normalize(target_df[col], max_level=0)
-        dict_col.index = target_df.index
-        target_df.drop(columns=col, inplace=True)
-        target_df = pd.merge(target_df, dict_col,
-                             left_index=True, right_index=True)
+        dict_col = pd.json_normalize(target_df[col].tolist(), max_level=0)
+        target_df = pd.concat([target_df.drop(columns=col), dict_col], axis=1)
 
     # Drop target component cols with dicts (for now; TODO: keep them and also expand them?)
     target_df.drop(columns=['target_component_synonyms',
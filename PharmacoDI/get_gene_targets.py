@@ -2,7 +2,7 @@ import pandas as pd
 from bs4 import BeautifulSoup
 import time
 from selenium import webdriver
-import requests
+from .utilities import HTTP_SESSION
 
 ensembl_gene_id = 'ENSG00000140465'
 
@@ -11,34 +11,27 @@ def get_gene_targets(ensembl_gene_id):
     """
     Query the APIs of Ensembl and NCBI to fetch information about drugs targeting a given gene.
 
-    :param gene_symbol: [string] The gene symbol for the desired target gene
     :param ensembl_gene_id: [string] The Ensembl gene id for the desired target gene
-    :return: [DataFrame] containing annotations for the specified gene
+    :return: [dict] The parsed HTML of each query (None if the request failed), keyed by query name
     """
-    # Configure requests to automatically raise errors
-    http = requests.Session()
-
-    assert_status_hook = lambda response, *args, **kwargs: response.raise_for_status()
-    http.hooks["response"] = [assert_status_hook]
-
-    # Query the APIs
-    queries = {'genecards_query':
-                   f"https://www.genecards.org/cgi-bin/carddisp.pl?id={ensembl_gene_id.upper()}&idtype=ensembl",
-               'ncbi_query': f"https://www.ncbi.nlm.nih.gov/gene/?term={ensembl_gene_id.upper()}"},
-    f"http://useast.ensembl.org/Homo_sapiens/Gene/Summary?g={ensembl_gene_id.upper()}"
-
-    api_requests = {key: requests.get(query) for key, query in queries.items()}
-
-    # Retry if 403
-    is_403 = [req.status_code == "403" for req in api_requests.values()]
-    if (any(is_403)):
-        to_update = queries.keys()[is_403]
-        updates = [requests.get(query) for query in queries.values()[is_403]]
-        api_requests.replace(dict(zip(to_update, updates)))  # Map replacement by value to dict key
+    # Query the APIs on the shared keep-alive session
+    queries = {
+        'genecards_query':
+            f"https://www.genecards.org/cgi-bin/carddisp.pl?id={ensembl_gene_id.upper()}&idtype=ensembl",
+        'ncbi_query': f"https://www.ncbi.nlm.nih.gov/gene/?term={ensembl_gene_id.upper()}",
+        'ensembl_query':
+            f"http://useast.ensembl.org/Homo_sapiens/Gene/Summary?g={ensembl_gene_id.upper()}"
+    }
+    api_requests = {key: HTTP_SESSION.get(query) for key, query in queries.items()}
+
+    # Retry once if 403
+    for key in [key for key, request in api_requests.items() if request.status_code == 403]:
+        api_requests[key] = HTTP_SESSION.get(queries[key])
 
     parsed_annotation_data = \
-        {key: BeautifulSoup(request.text, 'html.parser') if request.status_code == "200" else None
+        {key: BeautifulSoup(request.text, 'html.parser') if request.status_code == 200 else None
          for key, request in api_requests.items()}
+    return parsed_annotation_data
 
 
 def scrape_genecards(ensembl_gene_id):
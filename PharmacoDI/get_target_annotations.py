@@ -1,11 +1,15 @@
 import os
 #import PharmacoDI as di
 import pandas as pd
+import polars as pl
 import numpy as np
-import urllib
-import requests
-from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
+from .build_target_tables import _map_idmapping_batch
+
+# Number of ids mapped per UniProt ID mapping job; a single job for every 
+#>id is slow to run and to stream back
+UNIPROT_BATCH_SIZE = 5000
 
 def get_target_annotations(pset, annot_dir):
     """
@@ -14,77 +18,85 @@ def get_target_annotations(pset, annot_dir):
 
     :param pset:
     :param annot_dir:
-    :return:
+    :return: [`DataFrame`] The DrugBank drug to gene mappings, one row per drug id
     """
-    # Read in drug target annotations and gene annotations
-    drug_targets = pd.read_csv(os.path.join(annot_dir, 'drugbank_drug_targets_all.csv'))
-    rnaseq_df = pset.get("molecularProfiles").get("Kallisto_0.46.1.rnaseq").get("elementMetadata")
-
-    # Map genes to drugbank drug ids
-    genes_to_drugs = pd.merge(drug_targets.loc[:, ['Name', 'Gene Name', 'Drug IDs']],
-                              rnaseq_df.loc[:, ['gene_name', 'gene_id']],
-                              left_on='Gene Name', right_on='gene_name')
+    # Read in drug target annotations and gene annotations, only parsing the
+    #>columns that are used
+    drug_targets = pl.read_csv(os.path.join(annot_dir, 'drugbank_drug_targets_all.csv'),
+                               columns=['Name', 'Gene Name', 'Drug IDs'])
+    rnaseq_df = pl.from_pandas(
+        pset.get("molecularProfiles").get("Kallisto_0.46.1.rnaseq").get("elementMetadata")
+            .loc[:, ['gene_name', 'gene_id']])
+
+    # Map genes to drugbank drug ids with a multithreaded polars join; gene
+    #>names repeat on both sides, which rules out a keyed datatable join. The
+    #>keys are categorical under a shared string cache, so the join hashes 
+    #>int codes instead of strings; cast back so the result keeps strings
+    with pl.StringCache():
+        drug_targets = drug_targets \
+            .with_columns(pl.col('Gene Name').cast(pl.Categorical))
+        rnaseq_df = rnaseq_df \
+            .with_columns(pl.col('gene_name').cast(pl.Categorical))
+        genes_to_drugs = drug_targets.join(rnaseq_df, left_on='Gene Name',
+                                           right_on='gene_name', how='inner') \
+            .with_columns(pl.col('Gene Name').cast(pl.Utf8))
 
     # Annotate the genes
 
 
     # Expand list columns into rows and annotate drugs
-    genes_to_drugs['Drug IDs'] = [str.split(ids, '; ') for ids in genes_to_drugs['Drug IDs'].values]
-    genes_to_drugs = genes_to_drugs.explode('Drug IDs')
+    genes_to_drugs = genes_to_drugs \
+        .with_columns(pl.col('Drug IDs').str.split('; ')) \
+        .explode('Drug IDs')
 
 
     # Write to disk if necessary.
     file_path = os.path.join(annot_dir, 'drugbank_drug_to_gene_mappings.csv')
-    if not os.isfile(file_path):
-        pd.write_csv(genes_to_drugs, file_path)
-    pass
+    if not os.path.isfile(file_path):
+        genes_to_drugs.write_csv(file_path)
+    return genes_to_drugs.to_pandas()
 
 
 
-def query_uniprot_mapping_api(ids, convert_from="ACC+ID", to="ENSEMBL_ID"):
+def query_uniprot_mapping_api(ids, convert_from="UniProtKB_AC-ID", to="Ensembl",
+                              batch_size=UNIPROT_BATCH_SIZE, max_workers=4,
+                              poll_interval=3):
     """
-    Query the UniProt mapping API to convert between different gene/protein identifiers.
-    Defaults to converting UniProt AC or ID into ENESBLE gene id. The API, however,
-    supports a wide range of identifier conversions such as 'GENENAME', "EMBL", and
-    "P_ENTREZGENEID".
+    Query the UniProt ID mapping API to convert between different gene/protein identifiers.
+    Defaults to converting UniProt AC or ID into ENSEMBL gene id. The API, however,
+    supports a wide range of identifier conversions such as 'Gene_Name', 'EMBL', and
+    'GeneID'.
 
     Unmatched ids fail silently and will be excluded from the resulting DataFrame. They
-    can be retrieved by redoing your query in manually at https://www.uniprot.org/uploadlists/.
+    can be retrieved by redoing your query in manually at https://www.uniprot.org/id-mapping.
 
     Documentation for other potential conversions are available at:
-        https://www.uniprot.org/help/api_idmapping
+        https://www.uniprot.org/help/id_mapping
 
     :param ids: [`list`, `tuple` or `ndarray`] An iterable sequence type containing the gene/protein
         identifiers as strings.
-    :param convert_from: [`string`] The UniProt abbreviation for a format of gene/protein identifier.
-        Defaults to 'ACC+ID'.
-    :param to: [`string`] The Uniprot abbreviation for the desired gene/protein identifier. Defaults
-        to 'ENSEMBL'.
+    :param convert_from: [`string`] The UniProt name for a database of gene/protein identifiers.
+        Defaults to 'UniProtKB_AC-ID'.
+    :param to: [`string`] The UniProt name for the database of the desired gene/protein identifier.
+        Defaults to 'Ensembl'.
+    :param batch_size: [`int`] The number of ids to map per job. Defaults to 5000.
+    :param max_workers: [`int`] The number of jobs to run at once. Defaults to 4.
+    :param poll_interval: [`int`] Seconds to wait between job status checks. Defaults to 3.
     :return: [`DataFrame`] With the columns 'From' and 'To', mapping from the current id to the selected
         id type based on annotation in the UniProt database.
     """
-    # API URL
-    url = 'https://www.uniprot.org/uploadlists/'
-
-    # Build the query
-    query = ' '.join([str(id) for id in ids])
-    params = {
-        'from': convert_from,
-        'to': to,
-        'format': 'tab',
-        'query': query
-    }
-    query_string = urllib.parse.urlencode(params)
-
-    # Encode query and retrieve get request
-    query_string = query_string.encode('utf-8')
-    req = urllib.request.Request(url, query_string)
-    with urllib.request.urlopen(req) as f:
-        response = f.read()
-
-    # Decode query and convert to DataFrame
-    table_data = StringIO(response.decode("utf-8"))
-    uniprot_mapping_df = pd.read_table(table_data, sep="\t")
+    ids = [str(id) for id in ids]
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+    # Run the jobs with the ID mapping client from `build_target_tables`, 
+    #>which shares one keep-alive session between them
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        batch_dfs = list(executor.map(
+            lambda batch: _map_idmapping_batch(batch, poll_interval, 
+                convert_from, to, names=('From', 'To')), 
+            batches))
+    if not batch_dfs:
+        return pd.DataFrame(columns=['From', 'To'])
+    uniprot_mapping_df = pd.concat(batch_dfs, ignore_index=True, copy=False)
 
     return(uniprot_mapping_df)
-
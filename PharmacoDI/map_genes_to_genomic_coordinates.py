@@ -1,6 +1,7 @@
 from datatable import dt, f, g, join, sort, update, fread
-import numpy as np
-import re
+from PharmacoDI.combine_pset_tables import fread_table
+import polars as pl
+from PharmacoDI.utilities import ENS_VERSION_RE
 
 # -- Enable logging
 from loguru import logger
@@ -23,26 +24,32 @@ def map_genes_to_genomic_coordinates(gene_path, gene_annotation_path, gencode_pa
     and uses the gencode annotations to assign genomic coordinates to genes in gene_annotations
     before writing the updated table back to disk.
 
-    @param gene_path [`string`] Path to the gene table .csv
-    @param gene_annotation_path [`string`] Path to the gene_annotation table .csv
+    @param gene_path [`string`] Path to the gene table .parquet, .arrow, .jay or .csv
+    @param gene_annotation_path [`string`] Path to the gene_annotation table 
+        .parquet, .arrow, .jay or .csv; the updated table is written back in 
+        the same format
     @param gencode_path [`string`] Path tot he genecode annotation table .csv
     
     @return [None] Modifies gene_annotation table and writes .csv to disk
     """
 
     # -- Load in the required data
-    gene = fread(gene_path)
-    gene_annot = fread(gene_annotation_path)
+    gene = fread_table(gene_path)
+    gene_annot = fread_table(gene_annotation_path)
     gencode = fread(gencode_path)
 
-    vsub = np.vectorize(re.sub)
-    gencode[:, update(gene_id=vsub('[.][0-9]*$', '', gencode['gene_id'].to_numpy()))]
+    # Strip the ENSEMBL versions in polars, which applies the regex over the
+    #>Arrow column without materializing a Python string per row
+    gencode['gene_id'] = dt.Frame(
+        pl.from_arrow(gencode[:, 'gene_id'].to_arrow())
+            .select(pl.col('gene_id').str.replace(ENS_VERSION_RE.pattern, ''))
+            .to_arrow())
 
     # -- Add gene name back to gene_annotation
-    gene.key = 'id'
-    # join columns need the same name, stupid...
-    gene_annot[:, update(id = f.gene_id)]
-    gene_annot.key = 'id'
+    # join columns need the same name, so rename the key of gene (metadata
+    #>only) instead of copying gene_id into a new id column of gene_annot
+    gene.names = {'id': 'gene_id'}
+    gene.key = 'gene_id'
     gene_a = gene_annot[:, :, dt.join(gene)]
     gene_a = gene_a[:, [name not in ('symbol', 'strand') for name in gene_a.names]]
 
@@ -53,15 +60,27 @@ def map_genes_to_genomic_coordinates(gene_path, gene_annotation_path, gencode_pa
     gene_a.key = 'name'
 
     # -- Map coordinates to gene_annotations, check that nothing went wrong
-    gene_annotation = gene_a[:, :, dt.join(gencode)].copy()
-    # sanity check the mappings didn't get messed up
-    if not np.all(gene_annotation['name'].to_numpy() == gene['name'].to_numpy()):
+    gene_annotation = gene_a[:, :, dt.join(gencode)]
+    # sanity check the mappings didn't get messed up, comparing the names in 
+    #>datatable (cbind only references the columns) instead of as numpy arrays.
+    #>gene is sorted by id and gene_annotation by name, so this relies on the
+    #>gene ids following name order (see `combine_primary_tables`)
+    if gene_annotation.nrows != gene.nrows or \
+            dt.cbind(gene_annotation[:, {'mapped': f.name}], 
+                gene[:, {'original': f.name}])[f.mapped != f.original, :].nrows > 0:
         raise ValueError('The gene_annotation table got mangled while trying to map'
             'genomic coordinates!')
     
     # -- Clean up the table and write to disk
     gene_annotation[:, update(gene_seq_start=f.start, gene_seq_end=f.end, 
         chr=f.seqnames)]
-    del gene_annotation[:, ['name', 'id', 'start', 'end', 'seqnames']]
+    del gene_annotation[:, ['name', 'start', 'end', 'seqnames']]
 
-    gene_annotation.to_jay(gene_annotation_path)
+    if gene_annotation_path.endswith('.parquet'):
+        pl.from_arrow(gene_annotation.to_arrow()) \
+            .write_parquet(gene_annotation_path)
+    elif gene_annotation_path.endswith('.arrow'):
+        pl.from_arrow(gene_annotation.to_arrow()) \
+            .write_ipc(gene_annotation_path, compression='lz4')
+    else:
+        gene_annotation.to_jay(gene_annotation_path)
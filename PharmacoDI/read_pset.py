@@ -3,9 +3,15 @@ import os
 import re
 import numpy as np
 import pandas as pd
-import swifter  # Library to parallelize apply statements automagically
+from datatable import fread
+from concurrent.futures import ThreadPoolExecutor
 
 
+# Matches the parts of a PSet file name that aren't a slot or subitem name
+_FILE_NAME_AFFIX_RE = re.compile(r'.*@|\.csv\.gz$|\.csv$|\.parquet$|\.txt$')
+# The PSet file types `read_pset_file` can read
+_PSET_FILE_EXTENSIONS = ('.csv.gz', '.csv', '.parquet', '.txt')
+
 pset_name = 'NCI60'
 file_path = '../PharmacoDI_snakemake_pipeline/rawdata'
 slot_names = ['curation', 'drug', 'molecularProfiles',
@@ -43,9 +49,11 @@ def read_pset(
             f'No PSet directory named {pset_name} could be found in {file_path}'
         )
     
-    # List al files for the select PSet, then split on $ to make a DataFrame
-    pset_files = pd.Series(os.listdir(pset_dir))
-    pset_files = pset_files[~pset_files.str.startswith('.')]
+    # List all readable files for the select PSet in one pass over the 
+    #>directory, skipping hidden files, then split on $ to make a DataFrame
+    pset_files = pd.Series([entry.name for entry in os.scandir(pset_dir)
+        if entry.is_file() and not entry.name.startswith('.') 
+            and entry.name.endswith(_PSET_FILE_EXTENSIONS)])
     pset_files_df = pset_files.str.split('$', expand=True)
     
     # Build the file paths to read in data for each row of the DataFrame
@@ -59,17 +67,19 @@ def read_pset(
         'file_paths'
         ]
     
-    # Read in PSet data
-    pset_files_df['data'] = pset_files_df['file_paths'] \
-        .swifter.apply(read_pset_file)
+    # Read in PSet data concurrently; the CSV and Parquet readers release the
+    #>GIL while parsing, and threads return the DataFrames without pickling
+    with ThreadPoolExecutor(max_workers=min(16, len(pset_files_df) or 1)) \
+            as executor:
+        pset_files_df['data'] = list(executor.map(read_pset_file, 
+            pset_files_df['file_paths']))
     # Drop file_paths column by reference
     pset_files_df.drop('file_paths', axis='columns', inplace=True)
 
     # Process id columns to use the proper slot names
-    pset_files_df.iloc[:, 0:-1] = pset_files_df.iloc[:, 0:-1] \
-            .apply(lambda col:
-                col.str.replace('.*@|.csv.gz$|.csv$|.parquet$|.txt$', '')
-                )
+    for column in pset_files_df.columns[0:-1]:
+        pset_files_df[column] = pset_files_df[column] \
+            .str.replace(_FILE_NAME_AFFIX_RE, '', regex=True)
     
     return pset_files_df
 
@@ -78,7 +88,8 @@ def read_pset(
 def read_pset_file(file_path):
     """Deal with multiple file types to read in"""
     if '.csv.gz' in file_path or '.csv' in file_path:
-        return pd.read_csv(file_path)
+        # datatable parses the (decompressed) CSV in parallel chunks
+        return fread(file_path).to_pandas()
     elif '.parquet' in file_path:
         return pd.read_parquet(file_path)
     elif '.txt' in file_path:
@@ -99,16 +110,15 @@ def pset_df_to_nested_dict(df):
     @return: [`dict`] A nested dict with levels equal to the number of columns 
         of the original DataFrame minus one
     """
-    for key_check in pd.unique(df[df.columns[0]]):
-        if key_check is not None:
-            # Recursively nest the first column as key and remaning columns as values
-            return {
-                key: pset_df_to_nested_dict(df.loc[df[df.columns[0]] == key, df.columns[1:]]) 
-                    if df[1:].shape[1] > 2 
-                    else df.loc[df[df.columns[0]] == key, 'data'].values[0]
-                    for key in pd.unique(df[df.columns[0]])
-            }
-        else:
-            # Return the data column if there is no key
-            return df.iloc[:, -1].values[0]
-
+    # The first id column is empty when the slot has no (more) subitems
+    if df[df.columns[0]].iloc[0] is None:
+        # Return the data column if there is no key
+        return df.iloc[:, -1].values[0]
+    # Hash the rows into groups by key once, instead of masking the whole 
+    #>column for every key
+    groups = df.groupby(df.columns[0], sort=False)
+    if df.shape[1] > 2:
+        # Recursively nest the first column as key and remaning columns as values
+        return {key: pset_df_to_nested_dict(group.iloc[:, 1:]) 
+            for key, group in groups}
+    return {key: group['data'].values[0] for key, group in groups}
@@ -1,7 +1,28 @@
+import re
 import pandas as pd
 import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datatable import dt, f, g, join, update
 
+# Keep-alive session shared by the download and web API code (including the
+#>UniProt ID mapping jobs), so repeated requests to a host reuse pooled 
+#>connections instead of a new TCP/TLS handshake each. Rate limit and server
+#>errors are retried with backoff, including POSTs such as job submissions,
+#>and raise once the retries run out
+HTTP_SESSION = requests.Session()
+_HTTP_ADAPTER = HTTPAdapter(pool_connections=16, pool_maxsize=16, 
+    max_retries=Retry(total=5, backoff_factor=0.5, 
+        status_forcelist=(429, 500, 502, 503, 504), 
+        allowed_methods=('GET', 'POST')))
+HTTP_SESSION.mount('https://', _HTTP_ADAPTER)
+HTTP_SESSION.mount('http://', _HTTP_ADAPTER)
+
+# Matches the version suffix of an ENSEMBL identifier (ex. '.12'), shared by
+#>every module that strips gene versions
+ENS_VERSION_RE = re.compile(r'\.[0-9]+$')
+
 
 def harmonize_df_columns(
     df: pd.DataFrame,
@@ -25,26 +46,39 @@ def harmonize_df_columns(
     columns = np.asarray(list(column_dict.keys()))
     existing_columns = np.asarray(df.columns)
     has_columns = np.isin(columns, existing_columns)
-    # Select the columns of interest
-    df = df[list(columns[has_columns])].copy()
-    # Pad with missing columns
-    empty_column = [None for _ in range(df.shape[0])]
-    missing_column_dict = {key: value for key, value in column_dict.items() 
-        if key in list(columns[~has_columns])}
-    for column, dtype in missing_column_dict.items():
-        df[column] = pd.Series(empty_column, dtype=dtype)
-    # Check column types
+    # Select the columns of interest (assign below returns a new frame, so
+    #>the caller's df is never modified)
+    df = df[list(columns[has_columns])]
+    # Pad with missing columns, broadcasting None into each typed column 
+    #>instead of building a Python list of None per column
+    df = df.assign(**{column: pd.Series(None, index=df.index, 
+            dtype=object if dtype == str else dtype)
+        for column, dtype in column_dict.items() if column not in df.columns})
+    # Check column types from the column dtypes (not the first value of each
+    #>column), then cast all the mismatched columns in one astype call
+    casts = {}
     for column, dtype in column_dict.items():
-        if not isinstance(df[column][0], dtype):
-            try:
-                if isinstance(df[column][0], float) and dtype == str:
-                    # deal with lack of NA in Pandas int Series
-                    # also ensure floats converted to strings don't have decimals
+        if dtype == str:
+            if pd.api.types.is_float_dtype(df[column]):
+                # deal with lack of NA in Pandas int Series
+                # also ensure floats converted to strings don't have decimals
+                try:
                     df[column] = df[column].astype('Int64').astype(str) \
                         .replace({'<NA>': None})
-                else:
-                    df[column] = df[column].astype(dtype)
-            except TypeError:
+                except TypeError:
+                    casts[column] = dtype
+            elif not pd.api.types.is_object_dtype(df[column]):
+                casts[column] = dtype
+        elif df[column].dtype != np.dtype(dtype):
+            casts[column] = dtype
+    try:
+        df = df.astype(casts)
+    except (TypeError, ValueError):
+        # Find the failing columns, casting the rest
+        for column, dtype in casts.items():
+            try:
+                df[column] = df[column].astype(dtype)
+            except (TypeError, ValueError):
                 print(f'DataFrame column {column} failed to be coerced to'
                     f'{str(dtype)}!')
     return df
@@ -1,4 +1,7 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
 from datatable import dt, as_type
 
 # -- Enable logging
@@ -21,20 +24,72 @@ def write_pset_table(pset_df, df_name, pset_name, df_dir):
     """
     Write a PSet table to a .jay file.
 
-    @param pset_df: [`DataFrame`] A PSet DataFrame
+    @param pset_df: [`DataFrame` or `datatable.Frame`] A PSet table; Frames
+        are written as is
+    @param df_name: [`string`] The name of the table
     @param pset_name: [`string`] The name of the PSet
     @param df_dir: [`string`] The name of the directory to hold all the PSet tables
     @return [`None`]
     """
+    _write_pset_table(pset_df, df_name, pset_name, df_dir)
+
+
+def _write_pset_table(pset_df, df_name, pset_name, df_dir):
+    """Write a PSet table like `write_pset_table`, raising any error"""
     pset_path = os.path.join(df_dir, pset_name)
     # Make sure directory for this PSet exists
-    if not os.path.exists(pset_path):
-        os.mkdir(pset_path)
+    os.makedirs(pset_path, exist_ok=True)
 
-    # Convert to datatable Frame for fast write to disk
-    pset_df = dt.Frame(pset_df)
+    # Convert to datatable Frame for fast write to disk; Arrow backed pandas
+    #>columns are handed over as Arrow, instead of as arrays of Python objects
+    if isinstance(pset_df, pd.DataFrame) and \
+            any(isinstance(dtype, pd.ArrowDtype) for dtype in pset_df.dtypes):
+        pset_df = dt.Frame(pa.Table.from_pandas(pset_df, preserve_index=False))
+    elif not isinstance(pset_df, dt.Frame):
+        pset_df = dt.Frame(pset_df)
 
     print(f'Writing {df_name} table to {pset_path}...')
     # Use datatable to convert df to csv
     pset_df.to_jay(os.path.join(pset_path, f'{pset_name}_{df_name}.jay'))
-    
\ No newline at end of file
+
+
+def write_pset_tables(pset_dfs, pset_name, df_dir, max_workers=8):
+    """
+    Write all tables of a PSet to .jay files concurrently (see 
+    `write_pset_table`); datatable releases the GIL while it converts and
+    writes each Frame, so the writes overlap. Unlike `write_pset_table`, 
+    a failed write is raised, once the other writes have finished, so the
+    caller can tell the PSet tables are incomplete.
+
+    @param pset_dfs: [`dict`] The PSet tables, keyed by table name
+    @param pset_name: [`string`] The name of the PSet
+    @param df_dir: [`string`] The name of the directory to hold all the PSet tables
+    @param max_workers: [`int`] The maximum number of tables written at once
+    @return [`None`]
+    """
+    os.makedirs(os.path.join(df_dir, pset_name), exist_ok=True)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(pset_dfs) or 1)) \
+            as executor:
+        futures = [executor.submit(_write_pset_table, pset_df, df_name, 
+                pset_name, df_dir)
+            for df_name, pset_df in pset_dfs.items()]
+        for future in futures:
+            future.result()
+
+
+@logger.catch
+def export_pset_table_csv(df_name, pset_name, df_dir):
+    """
+    Export a PSet table written by `write_pset_table` to a .csv file next to
+    its .jay file, for consumers that need a text copy. The .jay file stays 
+    the intermediate format, since it is read back without parsing.
+
+    @param df_name: [`string`] The name of the table
+    @param pset_name: [`string`] The name of the PSet
+    @param df_dir: [`string`] The name of the directory to hold all the PSet tables
+    @return [`string`] The path to the .csv file
+    """
+    file_path = os.path.join(df_dir, pset_name, f'{pset_name}_{df_name}')
+    # datatable formats and writes the rows with multiple threads
+    dt.fread(f'{file_path}.jay').to_csv(f'{file_path}.csv')
+    return f'{file_path}.csv'
@@ -5,15 +5,15 @@ setup(name='PharmacoDI',
       description="Tools for processing R PharmacoSet objects into .csv files of PharmacoDB database tables.",
       url='https://github.com/bhklab/DataIngestion/tree/master/PharmacoDI',
       install_requires=[
-        'swifter',
         'datatable',
         'pandas',
         'chembl_webresource_client',
-        'wget',
+        'requests',
         'bs4',
         'selenium',
         'lxml',
-        'polars'
+        'polars>=1.25,<2',
+        'pyarrow'
       ],
       author='Evgeniya Gorobets, Christopher Eeles, Benjamin Haibe-Kains',
       author_email='christopher.eeles@uhnresearch.ca, benjamin.haibe.kains@utoronto.ca',